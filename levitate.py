@@ -47,6 +47,22 @@ bedrock = boto3.client(
     region_name=AWS_REGION
 )
 
+# ---------------- BUCKET CHANGE NOTIFICATIONS ----------------
+# Callbacks run with the bucket name after this app writes to it, so cached
+# listings can be dropped instead of re-listing the bucket on every poll
+_bucket_listeners = []
+
+def on_bucket_change(callback):
+    """Register callback(bucket) to run whenever this app writes to a bucket."""
+    _bucket_listeners.append(callback)
+
+def _notify_bucket_change(bucket: str):
+    for callback in _bucket_listeners:
+        try:
+            callback(bucket)
+        except Exception:
+            logger.exception(f"Bucket change listener failed for {bucket}")
+
 # ---------------- BEDROCK IMAGE GENERATION ----------------
 def generate_image(prompt: str, size: int = 512) -> bytes:
     """
@@ -102,6 +118,7 @@ def upload_image_to_s3(image_bytes: bytes, original_key: str) -> str:
         Body=image_bytes,
         ContentType="image/png"
     )
+    _notify_bucket_change(S3_COVER_BUCKET)
     
     # Generate a presigned URL (valid for 7 days)
     presigned_url = s3.generate_presigned_url(
@@ -140,6 +157,7 @@ async def upload_mp3(file: UploadFile = File(...)):
         # Upload to S3
         from io import BytesIO
         s3.upload_fileobj(BytesIO(contents), S3_BUCKET, file.filename)
+        _notify_bucket_change(S3_BUCKET)
         logger.info(f"Uploaded {file.filename} to S3 ({file_size / 1024:.1f} KB)")
         return {"status": "uploaded", "s3_key": file.filename}
     except HTTPException:
@@ -1,22 +1,31 @@
 """API routes for music generation backend."""
 
-from fastapi import APIRouter, UploadFile, File, HTTPException, BackgroundTasks
+from fastapi import (
+    APIRouter, UploadFile, File, HTTPException, BackgroundTasks,
+    Query, WebSocket, WebSocketDisconnect
+)
 from fastapi.responses import FileResponse
+from typing import Dict, List
 import os
+import asyncio
 import logging
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 
 from app.models import (
     UploadResponse, EmbeddingResponse, GenerationRequest,
     GenerationResponse, GenerationStatus, AudioAnalysis,
-    JobStatus
+    BatchAnalysisRequest, JobStatus
 )
 from app.config import settings
-from utils.storage import LocalStorage, MetadataStore, generate_unique_id
-from utils.audio_utils import get_audio_info
-from services.audio_processor import AudioProcessor
+from utils.storage import LocalStorage, MetadataStore, generate_unique_id, compute_file_hash
+from utils.audio_utils import get_audio_info, pack_features, unpack_features, FEATURES_VERSION
+from services.audio_processor import AudioProcessor, init_worker
 from services.embedder import AudioEmbedder
 from services.music_generator import MusicGenerator
+from services.generation_batcher import GenerationBatcher
 
 logger = logging.getLogger(__name__)
 
@@ -34,6 +43,17 @@ generated_storage = LocalStorage(settings.generated_dir)
 metadata_store = MetadataStore(settings.processed_dir)
 
 
+# Process pool for librosa work, keeps CPU-bound processing off the event loop.
+# Workers are spawned rather than forked: with models loaded, forking would
+# copy a parent that already holds torch and its OpenMP thread pools
+process_pool = ProcessPoolExecutor(
+    max_workers=settings.analysis_workers,
+    mp_context=multiprocessing.get_context("spawn"),
+    initializer=init_worker,
+    initargs=(max(1, (os.cpu_count() or 1) // settings.analysis_workers),)
+)
+
+
 def get_audio_processor():
     """Get or create audio processor instance."""
     global audio_processor
@@ -49,7 +69,8 @@ def get_embedder():
         logger.info("Initializing audio embedder...")
         embedder = AudioEmbedder(
             model_name=settings.embedding_model,
-            device=settings.device
+            device=settings.device,
+            compile_model=settings.compile_models
         )
     return embedder
 
@@ -61,11 +82,135 @@ def get_generator():
         logger.info("Initializing music generator...")
         generator = MusicGenerator(
             model_name=settings.generation_model,
-            device=settings.device
+            device=settings.device,
+            compile_model=settings.compile_models
         )
     return generator
 
 
+# In-process L1 in front of the metadata-store feature cache. Stored uploads
+# are named by their unique audio_id and never rewritten, so (path, sample
+# rate) identifies the features without re-hashing the file.
+FEATURES_MEMO_SIZE = 256
+features_memo: OrderedDict = OrderedDict()
+
+
+async def get_cached_features(audio_path: str) -> dict:
+    """
+    Get audio features, reusing cached results for identical file contents.
+    
+    Args:
+        audio_path: Path to audio file
+    
+    Returns:
+        Dictionary of audio features
+    """
+    processor = get_audio_processor()
+    memo_key = (audio_path, processor.target_sr)
+    if memo_key in features_memo:
+        features_memo.move_to_end(memo_key)
+        return features_memo[memo_key]
+    
+    features = await _load_or_extract_features(audio_path)
+    
+    features_memo[memo_key] = features
+    if len(features_memo) > FEATURES_MEMO_SIZE:
+        features_memo.popitem(last=False)
+    return features
+
+
+async def _load_or_extract_features(audio_path: str) -> dict:
+    """Get audio features from the persistent cache, extracting them on a miss."""
+    # Keyed by file content, processing sample rate and extractor version, so
+    # re-uploads hit the cache and extractor changes invalidate it
+    processor = get_audio_processor()
+    content_hash = await asyncio.to_thread(compute_file_hash, audio_path)
+    cache_key = f"features:{content_hash}:{processor.target_sr}:v{FEATURES_VERSION}"
+    
+    cached = metadata_store.load_metadata(cache_key)
+    if cached is not None:
+        return unpack_features(cached["features"])
+    
+    loop = asyncio.get_running_loop()
+    features = await loop.run_in_executor(
+        process_pool, processor.extract_features, audio_path
+    )
+    
+    packed = pack_features(features)
+    metadata_store.save_metadata(cache_key, {"features": packed})
+    
+    # Return what the cache will return on the next hit, so the result does
+    # not depend on which cache level served it
+    return unpack_features(packed)
+
+
+# Waiters for generation status changes. An event fires once, so it is
+# dropped when set and the next waiter creates a fresh one.
+status_events: Dict[str, asyncio.Event] = {}
+
+# Terminal job states; waiting for further changes is pointless
+FINAL_STATUSES = (JobStatus.COMPLETED, JobStatus.FAILED)
+STATUS_HEARTBEAT_SECONDS = 30
+
+
+def save_generation_metadata(generation_id: str, gen_metadata: dict):
+    """Persist a generation job's metadata and wake anyone waiting on it."""
+    metadata_store.save_metadata(f"gen_{generation_id}", gen_metadata)
+    event = status_events.pop(generation_id, None)
+    if event is not None:
+        event.set()
+
+
+async def wait_for_status_change(generation_id: str, timeout: float) -> bool:
+    """
+    Wait until a generation job's metadata is next saved.
+    
+    Args:
+        generation_id: Unique generation identifier
+        timeout: Maximum time to wait in seconds
+    
+    Returns:
+        True if the status changed, False on timeout
+    """
+    event = status_events.setdefault(generation_id, asyncio.Event())
+    try:
+        await asyncio.wait_for(event.wait(), timeout)
+        return True
+    except asyncio.TimeoutError:
+        return False
+
+
+def build_generation_status(generation_id: str, metadata: dict) -> GenerationStatus:
+    """
+    Build the status response for a generation job from its metadata.
+    
+    Args:
+        generation_id: Unique generation identifier
+        metadata: Stored generation metadata
+    
+    Returns:
+        Generation status
+    """
+    return GenerationStatus(
+        generation_id=generation_id,
+        audio_id=metadata["audio_id"],
+        status=metadata["status"],
+        progress=metadata.get("progress", 0),
+        file_path=metadata.get("file_path"),
+        error=metadata.get("error"),
+        created_at=datetime.fromisoformat(metadata["created_at"]),
+        completed_at=datetime.fromisoformat(metadata["completed_at"]) if metadata.get("completed_at") else None
+    )
+
+
+# Concurrent generation requests are batched into shared MusicGen forward passes
+generation_batcher = GenerationBatcher(
+    get_generator,
+    max_batch_size=settings.generation_batch_size,
+    max_wait_ms=settings.generation_batch_wait_ms
+)
+
+
 @router.post("/upload", response_model=UploadResponse)
 async def upload_audio(file: UploadFile = File(...)):
     """
@@ -86,37 +231,45 @@ async def upload_audio(file: UploadFile = File(...)):
                 detail=f"Invalid file type. Allowed: {settings.allowed_extensions}"
             )
         
+        # Reject early, without touching disk, when the size is already known
+        too_large = HTTPException(
+            status_code=400,
+            detail=f"File too large. Max size: {settings.max_file_size / 1024 / 1024}MB"
+        )
+        if file.size is not None and file.size > settings.max_file_size:
+            raise too_large
+        
         # Generate unique ID
         audio_id = generate_unique_id()
         
-        # Save file
+        # Stream file straight into upload storage in 1 MB chunks instead of
+        # buffering it in memory or staging it in /tmp; writes run on worker
+        # threads so concurrent uploads don't block the event loop
         filename = f"{audio_id}.{file_ext}"
-        temp_path = f"/tmp/{filename}"
         
-        with open(temp_path, "wb") as f:
-            content = await file.read()
-            f.write(content)
+        file_size = 0
+        while chunk := await file.read(1 << 20):
+            if file_size + len(chunk) > settings.max_file_size:
+                file_size += len(chunk)
+                break
+            await asyncio.to_thread(upload_storage.save_bytes, chunk, filename, file_size)
+            file_size += len(chunk)
+        audio_path = upload_storage.get_file_path(filename)
         
         # Check file size
-        file_size = os.path.getsize(temp_path)
         if file_size > settings.max_file_size:
-            os.remove(temp_path)
-            raise HTTPException(
-                status_code=400,
-                detail=f"File too large. Max size: {settings.max_file_size / 1024 / 1024}MB"
-            )
+            if os.path.exists(audio_path):
+                await asyncio.to_thread(os.remove, audio_path)
+            raise too_large
         
         # Get audio info
         try:
-            info = get_audio_info(temp_path)
+            info = await asyncio.to_thread(get_audio_info, audio_path)
         except Exception as e:
-            os.remove(temp_path)
+            if os.path.exists(audio_path):
+                await asyncio.to_thread(os.remove, audio_path)
             raise HTTPException(status_code=400, detail=f"Invalid audio file: {str(e)}")
         
-        # Move to upload storage
-        upload_storage.save_file(temp_path, filename)
-        os.remove(temp_path)
-        
         # Save metadata
         metadata = {
             "audio_id": audio_id,
@@ -179,17 +332,17 @@ async def get_embedding(audio_id: str):
             # Generate new embedding
             logger.info(f"Generating embedding for {audio_id}")
             
-            # Process audio
+            # Load and prepare audio at CLAP's 48 kHz in one resampling pass
             processor = get_audio_processor()
             audio_path = upload_storage.get_file_path(metadata["filename"])
-            audio, audio_metadata = processor.process_audio(audio_path)
-            
-            # Prepare for embedding
-            audio = processor.prepare_for_embedding(audio, audio_metadata["sample_rate"])
+            loop = asyncio.get_running_loop()
+            audio = await loop.run_in_executor(
+                process_pool, processor.process_for_embedding, audio_path
+            )
             
             # Generate embedding
             embedder_service = get_embedder()
-            embedding = embedder_service.generate_embedding(audio, sr=32000)
+            embedding = embedder_service.generate_embedding(audio, sr=48000)
             
             # Save embedding
             embedder_service.save_embedding(embedding, embedding_path)
@@ -233,32 +386,31 @@ async def generate_music_task(audio_id: str, generation_id: str, params: Generat
             "params": params.dict(),
             "created_at": datetime.utcnow().isoformat()
         }
-        metadata_store.save_metadata(f"gen_{generation_id}", gen_metadata)
+        save_generation_metadata(generation_id, gen_metadata)
         
         # Process audio
         processor = get_audio_processor()
         audio_path = upload_storage.get_file_path(metadata["filename"])
-        audio, audio_metadata = processor.process_audio(audio_path)
+        loop = asyncio.get_running_loop()
+        audio, audio_metadata = await loop.run_in_executor(
+            process_pool, processor.process_audio, audio_path
+        )
         
         # Update progress
         gen_metadata["progress"] = 30
-        metadata_store.save_metadata(f"gen_{generation_id}", gen_metadata)
+        save_generation_metadata(generation_id, gen_metadata)
         
-        # Generate music
+        # Generate music (batched with other concurrent requests)
         gen_service = get_generator()
-        generated_audio = gen_service.generate_from_audio(
-            audio=audio,
-            sr=audio_metadata["sample_rate"],
-            duration=params.duration,
-            temperature=params.temperature,
-            top_k=params.top_k,
-            top_p=params.top_p,
-            cfg_coef=params.cfg_coef
+        generated_audio = await generation_batcher.submit(
+            audio,
+            audio_metadata["sample_rate"],
+            params.dict()
         )
         
         # Update progress
         gen_metadata["progress"] = 80
-        metadata_store.save_metadata(f"gen_{generation_id}", gen_metadata)
+        save_generation_metadata(generation_id, gen_metadata)
         
         # Save generated audio
         output_path = generated_storage.get_file_path(f"{generation_id}")
@@ -269,7 +421,7 @@ async def generate_music_task(audio_id: str, generation_id: str, params: Generat
         gen_metadata["progress"] = 100
         gen_metadata["file_path"] = saved_path
         gen_metadata["completed_at"] = datetime.utcnow().isoformat()
-        metadata_store.save_metadata(f"gen_{generation_id}", gen_metadata)
+        save_generation_metadata(generation_id, gen_metadata)
         
         logger.info(f"Music generation completed: {generation_id}")
     
@@ -277,7 +429,7 @@ async def generate_music_task(audio_id: str, generation_id: str, params: Generat
         logger.error(f"Music generation failed: {str(e)}")
         gen_metadata["status"] = JobStatus.FAILED
         gen_metadata["error"] = str(e)
-        metadata_store.save_metadata(f"gen_{generation_id}", gen_metadata)
+        save_generation_metadata(generation_id, gen_metadata)
 
 
 @router.post("/generate/{audio_id}", response_model=GenerationResponse)
@@ -328,12 +480,19 @@ async def generate_music(
 
 
 @router.get("/status/{generation_id}", response_model=GenerationStatus)
-async def get_generation_status(generation_id: str):
+async def get_generation_status(
+    generation_id: str,
+    wait: float = Query(0, ge=0, le=60, description="Seconds to hold the request open for a status change")
+):
     """
     Get status of music generation job.
     
+    With wait > 0 this is a long poll: the response is held until the job's
+    status changes (or the wait expires), unless the job has already finished.
+    
     Args:
         generation_id: Unique generation identifier
+        wait: Maximum seconds to wait for a status change
     
     Returns:
         Generation status
@@ -343,16 +502,11 @@ async def get_generation_status(generation_id: str):
         if not metadata:
             raise HTTPException(status_code=404, detail="Generation job not found")
         
-        return GenerationStatus(
-            generation_id=generation_id,
-            audio_id=metadata["audio_id"],
-            status=metadata["status"],
-            progress=metadata.get("progress", 0),
-            file_path=metadata.get("file_path"),
-            error=metadata.get("error"),
-            created_at=datetime.fromisoformat(metadata["created_at"]),
-            completed_at=datetime.fromisoformat(metadata["completed_at"]) if metadata.get("completed_at") else None
-        )
+        if wait > 0 and metadata["status"] not in FINAL_STATUSES:
+            if await wait_for_status_change(generation_id, wait):
+                metadata = metadata_store.load_metadata(f"gen_{generation_id}")
+        
+        return build_generation_status(generation_id, metadata)
     
     except HTTPException:
         raise
@@ -361,6 +515,38 @@ async def get_generation_status(generation_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.websocket("/ws/status/{generation_id}")
+async def generation_status_ws(websocket: WebSocket, generation_id: str):
+    """
+    Push generation status updates over a WebSocket.
+    
+    Sends the current status on connect and again on every change, then
+    closes once the job has completed or failed.
+    
+    Args:
+        websocket: Client connection
+        generation_id: Unique generation identifier
+    """
+    await websocket.accept()
+    try:
+        while True:
+            metadata = metadata_store.load_metadata(f"gen_{generation_id}")
+            if not metadata:
+                await websocket.close(code=4404, reason="Generation job not found")
+                return
+            
+            status = build_generation_status(generation_id, metadata)
+            await websocket.send_json(status.model_dump(mode="json"))
+            if status.status in FINAL_STATUSES:
+                await websocket.close()
+                return
+            
+            # Re-send periodically even without a change so idle proxies keep the socket open
+            await wait_for_status_change(generation_id, STATUS_HEARTBEAT_SECONDS)
+    except WebSocketDisconnect:
+        logger.info(f"Status WebSocket closed by client: {generation_id}")
+
+
 @router.get("/download/{generation_id}")
 async def download_generated_music(generation_id: str):
     """
@@ -397,6 +583,34 @@ async def download_generated_music(generation_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def build_analysis(audio_id: str, metadata: dict) -> AudioAnalysis:
+    """
+    Build the analysis response for an audio file from its metadata.
+    
+    Args:
+        audio_id: Unique audio identifier
+        metadata: Stored audio metadata
+    
+    Returns:
+        Audio analysis
+    """
+    # Check if embedding exists
+    embedding_path = processed_storage.get_file_path(f"{audio_id}_embedding.npy")
+    embedding_available = os.path.exists(embedding_path)
+    
+    return AudioAnalysis(
+        audio_id=audio_id,
+        filename=metadata["original_filename"],
+        duration=metadata["duration"],
+        sample_rate=metadata["sample_rate"],
+        channels=metadata["channels"],
+        file_size=metadata["file_size"],
+        format=metadata["format"],
+        embedding_available=embedding_available,
+        features=unpack_features(metadata.get("features"))
+    )
+
+
 @router.get("/analyze/{audio_id}", response_model=AudioAnalysis)
 async def analyze_audio(audio_id: str):
     """
@@ -413,24 +627,58 @@ async def analyze_audio(audio_id: str):
         if not metadata:
             raise HTTPException(status_code=404, detail="Audio not found")
         
-        # Check if embedding exists
-        embedding_path = processed_storage.get_file_path(f"{audio_id}_embedding.npy")
-        embedding_available = os.path.exists(embedding_path)
+        # Extract features on first request (cached by file content)
+        if metadata.get("features") is None:
+            audio_path = upload_storage.get_file_path(metadata["filename"])
+            metadata["features"] = pack_features(await get_cached_features(audio_path))
+            metadata_store.save_metadata(audio_id, metadata)
         
-        return AudioAnalysis(
-            audio_id=audio_id,
-            filename=metadata["original_filename"],
-            duration=metadata["duration"],
-            sample_rate=metadata["sample_rate"],
-            channels=metadata["channels"],
-            file_size=metadata["file_size"],
-            format=metadata["format"],
-            embedding_available=embedding_available,
-            features=metadata.get("features")
-        )
+        return build_analysis(audio_id, metadata)
     
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"Analysis failed: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/batch_analyze", response_model=List[AudioAnalysis])
+async def batch_analyze_audio(request: BatchAnalysisRequest):
+    """
+    Analyze several uploaded audio files in parallel.
+    
+    Args:
+        request: Audio identifiers to analyze
+    
+    Returns:
+        Audio analyses, in request order
+    """
+    try:
+        metadata_by_id = {}
+        for audio_id in request.audio_ids:
+            metadata = metadata_store.load_metadata(audio_id)
+            if not metadata:
+                raise HTTPException(status_code=404, detail=f"Audio not found: {audio_id}")
+            metadata_by_id[audio_id] = metadata
+        
+        # Fan out extraction for files without features across the process pool
+        pending = [
+            audio_id for audio_id, metadata in metadata_by_id.items()
+            if metadata.get("features") is None
+        ]
+        results = await asyncio.gather(*(
+            get_cached_features(upload_storage.get_file_path(metadata_by_id[audio_id]["filename"]))
+            for audio_id in pending
+        ))
+        
+        for audio_id, features in zip(pending, results):
+            metadata_by_id[audio_id]["features"] = pack_features(features)
+            metadata_store.save_metadata(audio_id, metadata_by_id[audio_id])
+        
+        return [build_analysis(audio_id, metadata_by_id[audio_id]) for audio_id in request.audio_ids]
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Batch analysis failed: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
@@ -23,6 +23,15 @@ class Settings(BaseSettings):
     embedding_model: str = "laion/clap-htsat-unfused"
     generation_model: str = "facebook/musicgen-melody"  # melody model conditions on input for similar variations
     device: str = "cpu"
+    preload_models: bool = True  # load models at startup instead of on first request
+    compile_models: bool = False  # torch.compile model forwards (slow first call, faster after)
+    
+    # Audio processing workers (librosa runs in a process pool)
+    analysis_workers: int = os.cpu_count() or 1
+    
+    # Generation batching (concurrent requests share one forward pass)
+    generation_batch_size: int = 4
+    generation_batch_wait_ms: int = 50
     
     # Generation parameters
     default_duration: int = 30
@@ -56,12 +56,21 @@ async def startup_event():
     # Ensure directories exist
     settings.ensure_directories()
     logger.info("Storage directories initialized")
+    
+    # Load models before accepting traffic so the first request isn't a cold start
+    if settings.preload_models:
+        routes.get_audio_processor()
+        routes.get_embedder()
+        routes.get_generator()
+        logger.info("Models preloaded")
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Run on application shutdown."""
     logger.info("Shutting down application")
+    await routes.generation_batcher.stop()
+    routes.process_pool.shutdown(wait=False, cancel_futures=True)
 
 
 @app.get("/", include_in_schema=False)
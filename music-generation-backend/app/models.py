@@ -86,6 +86,11 @@ class AudioAnalysis(BaseModel):
     features: Optional[dict] = None
 
 
+class BatchAnalysisRequest(BaseModel):
+    """Request model for batch audio analysis."""
+    audio_ids: List[str] = Field(min_length=1, description="Audio identifiers to analyze")
+
+
 class HealthResponse(BaseModel):
     """Health check response."""
     status: str
@@ -3,16 +3,79 @@
 import numpy as np
 import librosa
 from typing import Dict, Tuple
+import ctypes
+import mmap
 import os
+import platform
+import sys
 from utils.audio_utils import (
-    load_audio, 
-    get_audio_info, 
+    open_audio,
     extract_audio_features,
-    validate_audio_file,
     normalize_audio
 )
 
 
+# x86-64: stmxcsr [rsp-4]; or dword [rsp-4], 0x8040 (FTZ | DAZ); ldmxcsr [rsp-4]; ret
+_MXCSR_FTZ_DAZ = bytes.fromhex("0fae5c24fc" "814c24fc40800000" "0fae5424fc" "c3")
+
+
+def enable_ftz_daz() -> bool:
+    """
+    Flush denormal floats to zero (FTZ/DAZ) for the current thread.
+    
+    Decaying tails and near-silent passages produce subnormal samples that
+    are orders of magnitude slower to compute with on x86. Uses torch when
+    it is already loaded; otherwise sets the MXCSR bits directly, so pool
+    workers don't import torch just for this.
+    
+    Returns:
+        True if denormals are now flushed, False otherwise
+    """
+    if "torch" in sys.modules:
+        return sys.modules["torch"].set_flush_denormal(True)
+    
+    # The stub writes below the stack pointer, which only the SysV red zone allows
+    if platform.machine() not in ("x86_64", "AMD64") or os.name != "posix":
+        return False
+    try:
+        page = mmap.mmap(-1, mmap.PAGESIZE, prot=mmap.PROT_READ | mmap.PROT_WRITE | mmap.PROT_EXEC)
+    except (OSError, AttributeError):
+        # W^X policies forbid executable anonymous mappings
+        return False
+    page.write(_MXCSR_FTZ_DAZ)
+    stub = ctypes.c_char.from_buffer(page)
+    ctypes.CFUNCTYPE(None)(ctypes.addressof(stub))()
+    del stub
+    page.close()
+    return True
+
+
+def init_worker(fft_workers: int):
+    """
+    Prepare a processing pool worker.
+    
+    Pins BLAS to one thread and limits FFTs to fft_workers threads so
+    parallel jobs don't oversubscribe the CPU, and flushes denormals to zero
+    in the worker itself, where the audio processing actually runs. Then
+    runs feature extraction once on a short clip so librosa's imports, FFT
+    setup and Numba kernels are warm before the first real file arrives.
+    
+    Lives here rather than next to the pool so spawned workers only import
+    this module, not the API routes and the model services behind them.
+    
+    Args:
+        fft_workers: FFT threads per transform in this worker
+    """
+    from threadpoolctl import threadpool_limits
+    threadpool_limits(1)
+    enable_ftz_daz()
+    
+    from utils.audio_utils import configure_fft_backend
+    configure_fft_backend(fft_workers)
+    warmup_sr = 22050
+    extract_audio_features(np.random.default_rng(0).standard_normal(warmup_sr).astype(np.float32), warmup_sr)
+
+
 class AudioProcessor:
     """Handle audio processing operations."""
     
@@ -24,6 +87,7 @@ class AudioProcessor:
             target_sr: Target sample rate for processing
         """
         self.target_sr = target_sr
+        enable_ftz_daz()
     
     def process_audio(self, file_path: str) -> Tuple[np.ndarray, Dict]:
         """
@@ -35,14 +99,14 @@ class AudioProcessor:
         Returns:
             Tuple of (processed_audio, metadata)
         """
-        # Validate file
-        validate_audio_file(file_path)
-        
-        # Get audio info
-        info = get_audio_info(file_path)
+        # Validate, get audio info, and load and resample audio in one open
+        audio, info = open_audio(file_path, sr=self.target_sr)
+        sr = self.target_sr
         
-        # Load and resample audio
-        audio, sr = load_audio(file_path, sr=self.target_sr)
+        # Keep the whole pipeline on contiguous float32; a float64 copy here
+        # would double memory traffic for every step below
+        if audio.dtype != np.float32 or not audio.flags.c_contiguous:
+            audio = np.ascontiguousarray(audio, dtype=np.float32)
         
         # Normalize audio
         audio = normalize_audio(audio)
@@ -62,6 +126,37 @@ class AudioProcessor:
         
         return audio, metadata
     
+    def extract_features(self, file_path: str) -> Dict:
+        """
+        Process audio file and return only its features.
+        
+        Args:
+            file_path: Path to audio file
+        
+        Returns:
+            Dictionary of audio features
+        """
+        _, metadata = self.process_audio(file_path)
+        return metadata["features"]
+    
+    def process_for_embedding(self, file_path: str, sr: int = 48000) -> np.ndarray:
+        """
+        Load audio straight at the embedding model's sample rate.
+        
+        Skips feature extraction and the intermediate target_sr stage, so
+        the file is resampled once instead of twice.
+        
+        Args:
+            file_path: Path to audio file
+            sr: Embedding model sample rate (CLAP expects 48000 Hz)
+        
+        Returns:
+            Normalized audio ready for embedding
+        """
+        audio, _ = open_audio(file_path, sr=sr)
+        audio = normalize_audio(np.ascontiguousarray(audio, dtype=np.float32))
+        return self.prepare_for_embedding(audio, sr)
+    
     def prepare_for_embedding(self, audio: np.ndarray, sr: int) -> np.ndarray:
         """
         Prepare audio for embedding generation.
@@ -78,9 +173,11 @@ class AudioProcessor:
         if len(audio) > max_samples:
             audio = audio[:max_samples]
         
-        # Pad if too short (min 5 seconds)
+        # Pad if too short (min 5 seconds); only the head needs copying
         min_samples = 5 * sr
         if len(audio) < min_samples:
-            audio = np.pad(audio, (0, min_samples - len(audio)), mode='constant')
+            padded = np.zeros(min_samples, dtype=audio.dtype)
+            padded[:len(audio)] = audio
+            audio = padded
         
         return audio
@@ -1,9 +1,17 @@
 """Audio embedding service using CLAP model."""
 
 import torch
+import torch.nn.functional as F
 import numpy as np
+import xxhash
 from transformers import ClapModel, ClapProcessor
+from collections import OrderedDict
+from typing import List, Optional
 import logging
+import os
+import tempfile
+
+from utils.audio_utils import resample_audio
 
 logger = logging.getLogger(__name__)
 
@@ -11,33 +19,148 @@ logger = logging.getLogger(__name__)
 class AudioEmbedder:
     """Generate embeddings from audio using CLAP model."""
     
-    def __init__(self, model_name: str = "laion/clap-htsat-unfused", device: str = "cpu"):
+    def __init__(self,
+                 model_name: str = "laion/clap-htsat-unfused",
+                 device: str = "cpu",
+                 cache_dir: Optional[str] = None,
+                 memory_cache_size: int = 256,
+                 compile_model: bool = False):
         """
         Initialize audio embedder.
         
         Args:
             model_name: HuggingFace model identifier
             device: Device to run model on ('cpu' or 'cuda')
+            cache_dir: Directory for cached embeddings (default: ~/.cache/clap_embeds)
+            memory_cache_size: Number of embeddings kept in the in-memory cache
+            compile_model: Compile the audio encoder with torch.compile
         """
         self.model_name = model_name
         self.device = device
+        self.compile_model = compile_model
+        # Half precision on GPU; CPUs without native bf16/fp16 math stay in float32
+        self.dtype = torch.float16 if device.startswith("cuda") else torch.float32
         self.model = None
         self.processor = None
+        
+        # Embeddings cached by (model, sample rate, audio content)
+        self.cache_dir = cache_dir or os.path.expanduser("~/.cache/clap_embeds")
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.memory_cache_size = memory_cache_size
+        self._memory_cache: OrderedDict = OrderedDict()
+        
         self._load_model()
     
     def _load_model(self):
         """Load CLAP model and processor."""
         try:
+            if self.device == "cpu":
+                torch.set_num_threads(os.cpu_count() or 1)
+            
             logger.info(f"Loading CLAP model: {self.model_name}")
             self.processor = ClapProcessor.from_pretrained(self.model_name)
-            self.model = ClapModel.from_pretrained(self.model_name)
-            self.model.to(self.device)
+            # Fused scaled-dot-product attention where this transformers build
+            # supports it for CLAP; older builds keep the eager attention
+            model_kwargs = {}
+            if getattr(ClapModel, "_supports_sdpa", False):
+                model_kwargs["attn_implementation"] = "sdpa"
+            if self.device.startswith("cuda"):
+                torch.backends.cuda.enable_flash_sdp(True)
+                torch.backends.cuda.enable_mem_efficient_sdp(True)
+            self.model = ClapModel.from_pretrained(self.model_name, **model_kwargs)
+            self.model.to(self.device, dtype=self.dtype)
             self.model.eval()
+            self._setup_feature_extraction()
+            if self.compile_model:
+                # Inputs are padded/truncated to a fixed length by the processor,
+                # so shapes are static and graph capture pays off
+                self.model.get_audio_features = torch.compile(
+                    self.model.get_audio_features, mode="reduce-overhead"
+                )
+                logger.info("CLAP audio encoder compiled")
             logger.info("CLAP model loaded successfully")
         except Exception as e:
             logger.error(f"Failed to load CLAP model: {str(e)}")
             raise
     
+    def _setup_feature_extraction(self):
+        """Mirror the CLAP feature extractor's log-mel front end on the model device."""
+        extractor = self.processor.feature_extractor
+        # Fused checkpoints stack several crops per clip; leave those to the processor
+        self._features_on_device = extractor.truncation != "fusion"
+        if not self._features_on_device:
+            return
+        
+        # Same slaney filter bank and periodic Hann window the extractor uses, [n_mels, n_freqs]
+        self._mel_filters = torch.from_numpy(
+            np.ascontiguousarray(extractor.mel_filters_slaney.T, dtype=np.float32)
+        ).to(self.device)
+        self._window = torch.hann_window(extractor.fft_window_size, device=self.device)
+        # Clips are always cropped/padded to the same window, so waveform
+        # buffers are allocated once per batch size and reused
+        self._input_buffers = {}
+    
+    def _extract_features(self, audios: List[np.ndarray]) -> dict:
+        """
+        Compute CLAP input features for a batch of 48 kHz clips on the model device.
+        
+        Args:
+            audios: Audio arrays at 48000 Hz
+        
+        Returns:
+            Model inputs ('input_features' as [batch, 1, frames, n_mels], 'is_longer')
+        """
+        extractor = self.processor.feature_extractor
+        max_length = extractor.nb_max_samples
+        
+        # Crop or pad every clip to the model's fixed window, as the extractor
+        # does, writing straight into a reused device buffer
+        waveforms = self._input_buffer(len(audios), max_length)
+        waveforms.zero_()
+        for row, audio in zip(waveforms, audios):
+            if len(audio) > max_length:
+                start = np.random.randint(0, len(audio) - max_length + 1)
+                audio = audio[start:start + max_length]
+            clip = torch.from_numpy(np.ascontiguousarray(audio, dtype=np.float32)).to(self.device)
+            
+            if extractor.padding == "repeat":
+                n_repeat = max_length // len(clip) + 1
+            elif extractor.padding == "repeatpad":
+                n_repeat = max_length // len(clip)
+            else:
+                n_repeat = 1
+            for offset in range(0, n_repeat * len(clip), len(clip)):
+                end = min(offset + len(clip), max_length)
+                row[offset:end].copy_(clip[:end - offset])
+        
+        # Power spectrogram -> slaney mel -> dB, kept in float32 for the log
+        spec = torch.stft(
+            waveforms,
+            n_fft=extractor.fft_window_size,
+            hop_length=extractor.hop_length,
+            window=self._window,
+            center=True,
+            pad_mode="reflect",
+            return_complex=True
+        )
+        mel = torch.matmul(self._mel_filters, spec.real.square() + spec.imag.square())
+        log_mel = 10.0 * torch.log10(torch.clamp(mel, min=1e-10))
+        
+        return {
+            "input_features": log_mel.transpose(1, 2).unsqueeze(1).to(self.dtype),
+            "is_longer": torch.tensor(
+                [[len(audio) > max_length] for audio in audios], device=self.device
+            )
+        }
+    
+    def _input_buffer(self, batch_size: int, length: int) -> torch.Tensor:
+        """Return the persistent [batch_size, length] waveform buffer, allocating it once."""
+        buffer = self._input_buffers.get(batch_size)
+        if buffer is None or buffer.shape[1] != length:
+            buffer = torch.empty((batch_size, length), dtype=torch.float32, device=self.device)
+            self._input_buffers[batch_size] = buffer
+        return buffer
+    
     def generate_embedding(self, audio: np.ndarray, sr: int = 48000) -> np.ndarray:
         """
         Generate embedding from audio.
@@ -49,46 +172,134 @@ class AudioEmbedder:
         Returns:
             Embedding vector as numpy array
         """
+        return self.generate_embeddings_batch([audio], sr=sr)[0]
+    
+    def generate_embeddings_batch(self, audios: List[np.ndarray], sr: int = 48000) -> List[np.ndarray]:
+        """
+        Generate embeddings for several clips in a single forward pass.
+        
+        Clips seen before are served from the cache; only the rest go
+        through the model.
+        
+        Args:
+            audios: Audio arrays (e.g. segments of one file)
+            sr: Sample rate (CLAP expects 48000 Hz)
+        
+        Returns:
+            Unit-norm embedding vectors, one per input (read-only, shared
+            with the cache; copy before modifying)
+        """
+        keys = [self._cache_key(audio, sr) for audio in audios]
+        embeddings = [self._cache_get(key) for key in keys]
+        
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            computed = self._embed_batch([audios[i] for i in missing], sr)
+            for i, embedding in zip(missing, computed):
+                embeddings[i] = embedding
+                self._cache_put(keys[i], embedding)
+        
+        return embeddings
+    
+    def _embed_batch(self, audios: List[np.ndarray], sr: int) -> List[np.ndarray]:
+        """Run the CLAP forward pass over a batch of clips."""
         try:
             # Resample if necessary
             if sr != 48000:
-                import librosa
-                audio = librosa.resample(audio, orig_sr=sr, target_sr=48000)
+                audios = [resample_audio(audio, sr, 48000) for audio in audios]
                 sr = 48000
             
-            # Process audio
-            inputs = self.processor(
-                audios=audio,
-                sampling_rate=sr,
-                return_tensors="pt"
-            )
-            
-            # Move to device
-            inputs = {k: v.to(self.device) for k, v in inputs.items()}
+            if self._features_on_device:
+                inputs = self._extract_features(audios)
+            else:
+                # Process audio
+                inputs = self.processor(
+                    audios=audios,
+                    sampling_rate=sr,
+                    return_tensors="pt"
+                )
+                
+                # Move to device, casting features to the model's precision
+                inputs = {
+                    k: v.to(self.device, dtype=self.dtype) if v.is_floating_point() else v.to(self.device)
+                    for k, v in inputs.items()
+                }
             
-            # Generate embedding
-            with torch.no_grad():
-                audio_embed = self.model.get_audio_features(**inputs)
+            # Generate embeddings, [batch, dim]
+            with torch.inference_mode():
+                audio_embeds = self.model.get_audio_features(**inputs)
             
-            # Convert to numpy and normalize
-            embedding = audio_embed.cpu().numpy().flatten()
-            embedding = embedding / np.linalg.norm(embedding)
-            
-            return embedding
+            # Normalize and cast on device so the host copy is the only sync
+            audio_embeds = F.normalize(audio_embeds, p=2, dim=-1)
+            return list(audio_embeds.to(torch.float32).cpu().numpy())
         
         except Exception as e:
             logger.error(f"Failed to generate embedding: {str(e)}")
             raise
     
+    def _cache_key(self, audio: np.ndarray, sr: int) -> str:
+        """Hash the model, sample rate and audio content into a cache key."""
+        hasher = xxhash.xxh3_64(f"{self.model_name}:{sr}:{audio.dtype.str}".encode())
+        hasher.update(np.ascontiguousarray(audio))
+        return hasher.hexdigest()
+    
+    def _cache_get(self, key: str) -> Optional[np.ndarray]:
+        """Look up an embedding in memory, then on disk."""
+        if key in self._memory_cache:
+            self._memory_cache.move_to_end(key)
+            return self._memory_cache[key]
+        
+        cache_path = os.path.join(self.cache_dir, f"{key}.npy")
+        try:
+            embedding = np.load(cache_path)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, EOFError):
+            # Unreadable or truncated entry: drop it and recompute
+            logger.warning(f"Discarding corrupt cached embedding: {cache_path}")
+            try:
+                os.remove(cache_path)
+            except OSError:
+                pass
+            return None
+        
+        self._remember(key, embedding)
+        return embedding
+    
+    def _cache_put(self, key: str, embedding: np.ndarray):
+        """Store an embedding in memory and on disk."""
+        self._remember(key, embedding)
+        # Write a temp file and rename it into place, so readers never see a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, embedding)
+            os.replace(tmp_path, os.path.join(self.cache_dir, f"{key}.npy"))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+    
+    def _remember(self, key: str, embedding: np.ndarray):
+        """Insert into the in-memory LRU, evicting the oldest entry when full."""
+        # Cached arrays are shared with every caller that hits the cache
+        embedding.flags.writeable = False
+        self._memory_cache[key] = embedding
+        self._memory_cache.move_to_end(key)
+        if len(self._memory_cache) > self.memory_cache_size:
+            self._memory_cache.popitem(last=False)
+    
     def save_embedding(self, embedding: np.ndarray, filepath: str):
         """
         Save embedding to file.
         
+        Stored as float16 to halve disk and I/O; cosine similarity on
+        unit-norm CLAP embeddings is robust to the rounding.
+        
         Args:
             embedding: Embedding array
             filepath: Output file path
         """
-        np.save(filepath, embedding)
+        np.save(filepath, embedding.astype(np.float16))
     
     def load_embedding(self, filepath: str) -> np.ndarray:
         """
@@ -98,6 +309,7 @@ class AudioEmbedder:
             filepath: Input file path
         
         Returns:
-            Embedding array
+            Embedding array (float32)
         """
-        return np.load(filepath)
+        # Memory-map so the upcast reads straight from the page cache
+        return np.load(filepath, mmap_mode='r').astype(np.float32)
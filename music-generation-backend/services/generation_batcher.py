@@ -0,0 +1,109 @@
+"""Micro-batching scheduler for music generation requests."""
+
+import asyncio
+import functools
+import logging
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class GenerationBatcher:
+    """Collect concurrent generation requests and run them as batched forward passes."""
+    
+    def __init__(self, get_generator: Callable, max_batch_size: int = 4, max_wait_ms: int = 50):
+        """
+        Initialize generation batcher.
+        
+        Args:
+            get_generator: Callable returning the MusicGenerator to run batches on
+            max_batch_size: Maximum number of requests per forward pass
+            max_wait_ms: How long to wait for more requests after the first arrives
+        """
+        self.get_generator = get_generator
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+    
+    async def submit(self, audio: np.ndarray, sr: int, params: Dict) -> np.ndarray:
+        """
+        Queue a generation request and wait for its result.
+        
+        Args:
+            audio: Input audio array
+            sr: Sample rate of input audio
+            params: Generation parameters (duration, temperature, top_k, top_p, cfg_coef)
+        
+        Returns:
+            Generated audio array
+        """
+        if self._worker is None:
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+        
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((audio, sr, params, future))
+        return await future
+    
+    async def stop(self):
+        """Stop the batching worker."""
+        if self._worker is None:
+            return
+        
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+    
+    async def _run(self):
+        """Drain the queue into batches of up to max_batch_size requests."""
+        loop = asyncio.get_running_loop()
+        
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            
+            # Only requests with identical parameters and prompt shape can share a pass
+            groups: Dict[tuple, List[tuple]] = {}
+            for request in batch:
+                audio, sr, params, _ = request
+                key = (sr, len(audio), tuple(sorted(params.items())))
+                groups.setdefault(key, []).append(request)
+            
+            for requests in groups.values():
+                await self._generate(requests)
+    
+    async def _generate(self, requests: List[tuple]):
+        """Run one batched generation off the event loop and resolve its futures."""
+        _, sr, params, _ = requests[0]
+        audios = [audio for audio, _, _, _ in requests]
+        futures = [future for _, _, _, future in requests]
+        
+        try:
+            generator = self.get_generator()
+            generate = functools.partial(generator.generate_batch_from_audio, audios, sr, **params)
+            results = await asyncio.get_running_loop().run_in_executor(None, generate)
+        except Exception as e:
+            logger.error(f"Batched generation failed: {str(e)}")
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        
+        for future, result in zip(futures, results):
+            if not future.done():
+                future.set_result(result)
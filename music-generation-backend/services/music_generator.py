@@ -2,10 +2,19 @@
 
 import torch
 import numpy as np
+import soundfile as sf
+import xxhash
 from audiocraft.models import MusicGen
 from audiocraft.data.audio import audio_write
+from audiocraft.data.audio_utils import convert_audio
+from audiocraft.utils.autocast import TorchAutocast
+from collections import OrderedDict
+import copy
 import logging
 import os
+from typing import List
+
+from utils.audio_utils import resample_audio
 
 logger = logging.getLogger(__name__)
 
@@ -13,17 +22,28 @@ logger = logging.getLogger(__name__)
 class MusicGenerator:
     """Generate music using MusicGen model."""
     
-    def __init__(self, model_name: str = "facebook/musicgen-small", device: str = "cpu"):
+    def __init__(self,
+                 model_name: str = "facebook/musicgen-small",
+                 device: str = "cpu",
+                 compile_model: bool = False,
+                 prompt_cache_size: int = 8):
         """
         Initialize music generator.
         
         Args:
             model_name: Model identifier (small, medium, large, or melody)
             device: Device to run model on ('cpu' or 'cuda')
+            compile_model: Compile the LM forward with torch.compile
+            prompt_cache_size: Number of encoded audio prompts kept for reuse
         """
         self.model_name = model_name
         self.device = device
+        self.compile_model = compile_model
         self.model = None
+        
+        # Encoded prompt tokens and conditioning attributes, keyed by prompt content
+        self.prompt_cache_size = prompt_cache_size
+        self._prompt_cache: OrderedDict = OrderedDict()
         self._load_model()
     
     def _load_model(self):
@@ -43,11 +63,36 @@ class MusicGenerator:
                 size = "small"
             
             self.model = MusicGen.get_pretrained(size, device=self.device)
+            if self.device.startswith("cuda"):
+                # audiocraft's memory-efficient attention dispatches to
+                # torch SDPA; make sure the fused kernels are allowed
+                torch.backends.cuda.enable_flash_sdp(True)
+                torch.backends.cuda.enable_mem_efficient_sdp(True)
+                self._configure_precision()
+            if self.compile_model:
+                # The KV cache grows every decode step, so compile with dynamic shapes
+                self.model.lm.forward = torch.compile(self.model.lm.forward, dynamic=True)
+                logger.info("MusicGen LM forward compiled")
             logger.info(f"MusicGen model loaded successfully on {self.device}")
         except Exception as e:
             logger.error(f"Failed to load MusicGen model: {str(e)}")
             raise
     
+    def _configure_precision(self):
+        """Run the LM in bfloat16 on GPUs that support it."""
+        # audiocraft already loads the LM in float16 with float16 autocast on
+        # CUDA; bfloat16 keeps the same bandwidth with float32's range
+        if not torch.cuda.is_bf16_supported():
+            return
+        
+        self.model.lm = self.model.lm.to(torch.bfloat16)
+        self.model.autocast = TorchAutocast(
+            enabled=True,
+            device_type="cuda",
+            dtype=torch.bfloat16
+        )
+        logger.info("MusicGen LM running in bfloat16")
+    
     def generate_from_audio(self, 
                           audio: np.ndarray,
                           sr: int,
@@ -71,7 +116,43 @@ class MusicGenerator:
         Returns:
             Generated audio array
         """
+        return self.generate_batch_from_audio(
+            [audio],
+            sr,
+            duration=duration,
+            temperature=temperature,
+            top_k=top_k,
+            top_p=top_p,
+            cfg_coef=cfg_coef
+        )[0]
+    
+    def generate_batch_from_audio(self,
+                                  audios: List[np.ndarray],
+                                  sr: int,
+                                  duration: int = 30,
+                                  temperature: float = 1.0,
+                                  top_k: int = 250,
+                                  top_p: float = 0.0,
+                                  cfg_coef: float = 3.0) -> List[np.ndarray]:
+        """
+        Generate music for several same-length inputs in one forward pass.
+        
+        Args:
+            audios: Input audio arrays, all with the same number of samples
+            sr: Sample rate of input audio
+            duration: Duration of generated audio in seconds
+            temperature: Sampling temperature (higher = more random)
+            top_k: Top-k sampling parameter
+            top_p: Top-p (nucleus) sampling parameter
+            cfg_coef: Classifier-free guidance coefficient
+        
+        Returns:
+            Generated audio arrays, one per input
+        """
         try:
+            if len({len(audio) for audio in audios}) > 1:
+                raise ValueError("All inputs in a batch must have the same length")
+            
             # Set generation parameters
             self.model.set_generation_params(
                 duration=duration,
@@ -84,41 +165,86 @@ class MusicGenerator:
             # Prepare audio for conditioning
             # MusicGen expects audio at 32kHz
             if sr != 32000:
-                import librosa
-                audio = librosa.resample(audio, orig_sr=sr, target_sr=32000)
+                audios = [resample_audio(audio, sr, 32000) for audio in audios]
             
-            # Convert to torch tensor (batch, channels, samples) for conditioning
-            audio_tensor = torch.from_numpy(audio).float().unsqueeze(0).unsqueeze(0)
+            # Stack into a (batch, channels, samples) tensor for conditioning
+            prompt = np.ascontiguousarray(np.stack(audios), dtype=np.float32)
+            audio_tensor = torch.from_numpy(prompt).unsqueeze(1)
             audio_tensor = audio_tensor.to(self.device)
             
-            logger.info(f"Generating similar variation (duration: {duration}s, temp: {temperature})")
+            logger.info(
+                f"Generating {len(audios)} similar variation(s) "
+                f"(duration: {duration}s, temp: {temperature})"
+            )
             
             # Generate music: melody model uses input audio for similar variations; others fall back to text
-            with torch.no_grad():
+            with torch.inference_mode():
                 if hasattr(self.model, 'generate_continuation'):
                     # Melody model: conditions on input audio → similar variations
-                    generated = self.model.generate_continuation(
+                    generated = self._generate_continuation(
                         audio_tensor,
-                        prompt_sample_rate=32000,
-                        progress=True
+                        self._prompt_key(prompt)
                     )
                 else:
                     generated = self.model.generate(
-                        descriptions=["instrumental music"],
+                        descriptions=["instrumental music"] * len(audios),
                         progress=True
                     )
             
-            # Convert to numpy
-            generated_audio = generated.cpu().numpy().squeeze()
+            # Convert to numpy, one array per input
+            generated_audios = [item.squeeze() for item in generated.cpu().numpy()]
             
             logger.info("Music generation completed")
-            return generated_audio
+            return generated_audios
         
         except Exception as e:
             logger.error(f"Failed to generate music: {str(e)}")
             raise
     
-    def save_audio(self, audio: np.ndarray, output_path: str, sr: int = 32000):
+    def _generate_continuation(self, audio_tensor: torch.Tensor, key: str) -> torch.Tensor:
+        """
+        Equivalent of MusicGen.generate_continuation that reuses encoded prompts.
+        
+        Encoding the prompt through EnCodec and preparing the conditioning
+        attributes depends only on the input audio, so variations of the
+        same prompt skip straight to token sampling.
+        
+        Args:
+            audio_tensor: Prompt audio, (batch, channels, samples) at 32 kHz
+            key: Content key of the prompt (see _prompt_key)
+        
+        Returns:
+            Generated audio tensor
+        """
+        cached = self._prompt_cache.get(key)
+        if cached is None:
+            prompt = convert_audio(
+                audio_tensor, 32000, self.model.sample_rate, self.model.audio_channels
+            )
+            cached = self.model._prepare_tokens_and_attributes([None] * len(prompt), prompt)
+            self._prompt_cache[key] = cached
+            if len(self._prompt_cache) > self.prompt_cache_size:
+                self._prompt_cache.popitem(last=False)
+        else:
+            logger.info("Reusing encoded prompt from cache")
+        self._prompt_cache.move_to_end(key)
+        
+        attributes, prompt_tokens = cached
+        # The LM rewrites attributes for classifier-free guidance; keep the cached copy intact
+        tokens = self.model._generate_tokens(copy.deepcopy(attributes), prompt_tokens, True)
+        return self.model.generate_audio(tokens)
+    
+    def _prompt_key(self, prompt: np.ndarray) -> str:
+        """Hash the model and prompt content into a prompt cache key."""
+        hasher = xxhash.xxh3_64(f"{self.model_name}:{prompt.shape}".encode())
+        hasher.update(prompt)
+        return hasher.hexdigest()
+    
+    def save_audio(self,
+                   audio: np.ndarray,
+                   output_path: str,
+                   sr: int = 32000,
+                   use_loudness: bool = False):
         """
         Save generated audio to file.
         
@@ -126,22 +252,30 @@ class MusicGenerator:
             audio: Audio array
             output_path: Output file path (without extension)
             sr: Sample rate
+            use_loudness: Apply audiocraft's loudness normalization and
+                compressor instead of a plain peak normalization
         """
         try:
             # Remove extension if present
             output_path = os.path.splitext(output_path)[0]
             
-            # Convert to torch tensor
-            audio_tensor = torch.from_numpy(audio).unsqueeze(0)
-            
-            # Save using audiocraft's audio_write (saves as WAV)
-            audio_write(
-                output_path,
-                audio_tensor,
-                sr,
-                strategy="loudness",
-                loudness_compressor=True
-            )
+            if use_loudness:
+                # Convert to torch tensor
+                audio_tensor = torch.from_numpy(audio).unsqueeze(0)
+                
+                # Save using audiocraft's audio_write (saves as WAV)
+                audio_write(
+                    output_path,
+                    audio_tensor,
+                    sr,
+                    strategy="loudness",
+                    loudness_compressor=True
+                )
+            else:
+                # Peak-normalize to 95% full scale and write 16-bit PCM directly
+                peak = float(np.abs(audio).max()) + 1e-9
+                audio_i16 = (audio * (0.95 * 32767 / peak)).astype(np.int16)
+                sf.write(f"{output_path}.wav", audio_i16, sr, subtype="PCM_16")
             
             logger.info(f"Audio saved to {output_path}.wav")
             return f"{output_path}.wav"
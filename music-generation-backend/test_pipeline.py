@@ -6,14 +6,18 @@ This script demonstrates the core functionality without the API.
 
 import sys
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 # Add parent directory to path
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from services.audio_processor import AudioProcessor
+from services.audio_processor import AudioProcessor, enable_ftz_daz
 from services.embedder import AudioEmbedder
 from services.music_generator import MusicGenerator
 import numpy as np
+from numba import njit, prange
+
+enable_ftz_daz()
 
 
 def test_embedding_and_generation(audio_file_path: str):
@@ -27,6 +31,17 @@ def test_embedding_and_generation(audio_file_path: str):
     print("Music Generation Pipeline Test")
     print("=" * 60)
     
+    # Model loading is disk-bound and independent of the input, so start
+    # both loads now and let them overlap with audio processing
+    loader = ThreadPoolExecutor(max_workers=2)
+    embedder_future = loader.submit(
+        AudioEmbedder, model_name="laion/clap-htsat-unfused", device="cpu"
+    )
+    generator_future = loader.submit(
+        MusicGenerator, model_name="facebook/musicgen-small", device="cpu"
+    )
+    loader.shutdown(wait=False)
+    
     # Step 1: Process Audio
     print("\n[1/4] Processing audio...")
     processor = AudioProcessor(target_sr=32000)
@@ -41,12 +56,12 @@ def test_embedding_and_generation(audio_file_path: str):
     print("\n[2/4] Generating audio embedding...")
     print("  (This may take a minute on first run - downloading model)")
     
-    embedder = AudioEmbedder(model_name="laion/clap-htsat-unfused", device="cpu")
+    embedder = embedder_future.result()
     
-    # Prepare audio for embedding
-    audio_for_embedding = processor.prepare_for_embedding(audio, metadata['sample_rate'])
+    # Load a 48 kHz copy for CLAP rather than resampling the 32 kHz one
+    audio_for_embedding = processor.process_for_embedding(audio_file_path)
     
-    embedding = embedder.generate_embedding(audio_for_embedding, sr=32000)
+    embedding = embedder.generate_embedding(audio_for_embedding, sr=48000)
     
     print(f"  ✓ Embedding dimension: {len(embedding)}")
     print(f"  ✓ Embedding norm: {np.linalg.norm(embedding):.4f}")
@@ -61,7 +76,7 @@ def test_embedding_and_generation(audio_file_path: str):
     print("\n[3/4] Generating similar music...")
     print("  (This may take 2-3 minutes on CPU)")
     
-    generator = MusicGenerator(model_name="facebook/musicgen-small", device="cpu")
+    generator = generator_future.result()
     
     # Generate music using the original audio as conditioning
     generated_audio = generator.generate_from_audio(
@@ -97,9 +112,22 @@ def test_embedding_and_generation(audio_file_path: str):
     print(f"  3. Try different generation parameters")
 
 
+@njit(parallel=True, fastmath=True, cache=True)
+def _synth(freqs, n_notes, samples_per_note, n_samples, sr):
+    """Render the note sequence plus a 440 Hz harmonic, one sample per iteration."""
+    audio = np.empty(n_samples, dtype=np.float32)
+    for i in prange(n_samples):
+        t = i / sr
+        sample = 0.1 * np.sin(4 * np.pi * 440 * t)
+        note = i // samples_per_note
+        if note < n_notes:
+            sample += 0.3 * np.sin(2 * np.pi * freqs[note % freqs.shape[0]] * t)
+        audio[i] = sample
+    return audio
+
+
 def create_test_audio():
     """Create a simple test audio file if none exists."""
-    import numpy as np
     from utils.audio_utils import save_audio
     
     print("Creating test audio file...")
@@ -107,25 +135,19 @@ def create_test_audio():
     # Generate a simple sine wave melody
     duration = 10  # seconds
     sr = 32000
-    t = np.linspace(0, duration, int(sr * duration))
     
     # Create a simple melody (C-E-G-C major chord progression)
-    frequencies = [261.63, 329.63, 392.00, 523.25]  # Hz
-    audio = np.zeros_like(t)
+    frequencies = np.array([261.63, 329.63, 392.00, 523.25])  # Hz
     
     notes_per_second = 2
     samples_per_note = int(sr / notes_per_second)
+    n_notes = len(frequencies) * (duration * notes_per_second // 4)
     
-    for i, freq in enumerate(frequencies * (duration * notes_per_second // 4)):
-        start = i * samples_per_note
-        end = min(start + samples_per_note, len(t))
-        audio[start:end] += 0.3 * np.sin(2 * np.pi * freq * t[start:end])
-    
-    # Add some harmonics for richness
-    audio += 0.1 * np.sin(4 * np.pi * 440 * t)
+    # Melody and harmonics are accumulated in a single compiled pass
+    audio = _synth(frequencies, n_notes, samples_per_note, int(sr * duration), sr)
     
     # Normalize
-    audio = audio / np.abs(audio).max() * 0.8
+    audio *= 0.8 / np.abs(audio).max()
     
     output_file = "data/uploads/test_audio.wav"
     save_audio(audio, output_file, sr)
@@ -1,6 +1,7 @@
 """Test suite for music generation API."""
 
-import requests
+import httpx
+import asyncio
 import time
 import os
 import json
@@ -8,6 +9,11 @@ import json
 # Configuration
 BASE_URL = "http://localhost:8000"
 API_URL = f"{BASE_URL}/api"
+WS_URL = "ws://localhost:8000/api"
+
+# Keep-alive connection pool shared by the whole suite. HTTP/2 stays off:
+# uvicorn only speaks HTTP/1.1, so concurrent calls use pooled connections
+CLIENT_LIMITS = httpx.Limits(max_connections=16, max_keepalive_connections=4)
 
 # Test audio file path (you'll need to provide this)
 TEST_AUDIO_FILE = "test_audio.mp3"  # Replace with actual test file
@@ -20,11 +26,11 @@ def print_section(title):
     print("=" * 60)
 
 
-def test_health_check():
+async def test_health_check(client):
     """Test health check endpoint."""
     print_section("Testing Health Check")
     
-    response = requests.get(f"{BASE_URL}/health")
+    response = await client.get(f"{BASE_URL}/health")
     print(f"Status Code: {response.status_code}")
     print(f"Response: {json.dumps(response.json(), indent=2)}")
     
@@ -32,7 +38,7 @@ def test_health_check():
     print("✓ Health check passed")
 
 
-def test_upload_audio():
+async def test_upload_audio(client):
     """Test audio upload."""
     print_section("Testing Audio Upload")
     
@@ -43,7 +49,7 @@ def test_upload_audio():
     
     with open(TEST_AUDIO_FILE, 'rb') as f:
         files = {'file': (os.path.basename(TEST_AUDIO_FILE), f, 'audio/mpeg')}
-        response = requests.post(f"{API_URL}/upload", files=files)
+        response = await client.post(f"{API_URL}/upload", files=files)
     
     print(f"Status Code: {response.status_code}")
     print(f"Response: {json.dumps(response.json(), indent=2)}")
@@ -58,7 +64,7 @@ def test_upload_audio():
     return audio_id
 
 
-def test_get_embedding(audio_id):
+async def test_get_embedding(client, audio_id):
     """Test embedding generation."""
     print_section("Testing Embedding Generation")
     
@@ -67,7 +73,7 @@ def test_get_embedding(audio_id):
         return
     
     print(f"Getting embedding for audio_id: {audio_id}")
-    response = requests.get(f"{API_URL}/embedding/{audio_id}")
+    response = await client.get(f"{API_URL}/embedding/{audio_id}")
     
     print(f"Status Code: {response.status_code}")
     
@@ -80,7 +86,7 @@ def test_get_embedding(audio_id):
         print(f"Response: {response.text}")
 
 
-def test_analyze_audio(audio_id):
+async def test_analyze_audio(client, audio_id):
     """Test audio analysis."""
     print_section("Testing Audio Analysis")
     
@@ -88,7 +94,7 @@ def test_analyze_audio(audio_id):
         print("⚠ Skipping - no audio_id")
         return
     
-    response = requests.get(f"{API_URL}/analyze/{audio_id}")
+    response = await client.get(f"{API_URL}/analyze/{audio_id}")
     
     print(f"Status Code: {response.status_code}")
     print(f"Response: {json.dumps(response.json(), indent=2)}")
@@ -97,7 +103,7 @@ def test_analyze_audio(audio_id):
     print("✓ Audio analysis retrieved successfully")
 
 
-def test_generate_music(audio_id):
+async def test_generate_music(client, audio_id):
     """Test music generation."""
     print_section("Testing Music Generation")
     
@@ -114,7 +120,7 @@ def test_generate_music(audio_id):
     }
     
     print(f"Starting generation with params: {payload}")
-    response = requests.post(
+    response = await client.post(
         f"{API_URL}/generate/{audio_id}",
         json=payload
     )
@@ -132,142 +138,231 @@ def test_generate_music(audio_id):
     return generation_id
 
 
-def test_generation_status(generation_id):
-    """Test generation status polling."""
-    print_section("Testing Generation Status")
-    
-    if not generation_id:
-        print("⚠ Skipping - no generation_id")
+def report_status(data):
+    """Print a status update; return True/False once the job finished, else None."""
+    status = data['status']
+    progress = data['progress']
+    
+    print(f"Status: {status} | Progress: {progress}%", end='\r')
+    
+    if status == 'completed':
+        print(f"\n✓ Generation completed successfully")
+        return True
+    elif status == 'failed':
+        print(f"\n✗ Generation failed: {data.get('error')}")
         return False
-    
-    max_wait = 300  # 5 minutes
+    return None
+
+
+async def watch_status_ws(generation_id, max_wait):
+    """Follow status updates pushed over the WebSocket endpoint."""
+    import websockets
+    
+    async with websockets.connect(f"{WS_URL}/ws/status/{generation_id}", open_timeout=10) as ws:
+        start_time = time.time()
+        while time.time() - start_time < max_wait:
+            message = await asyncio.wait_for(ws.recv(), timeout=max_wait)
+            result = report_status(json.loads(message))
+            if result is not None:
+                return result
+    return None
+
+
+async def watch_status_long_poll(client, generation_id, max_wait):
+    """Follow status updates by long-polling the status endpoint."""
     start_time = time.time()
     
     while time.time() - start_time < max_wait:
-        response = requests.get(f"{API_URL}/status/{generation_id}")
+        # The server holds the request until the status changes (up to 30s)
+        response = await client.get(
+            f"{API_URL}/status/{generation_id}",
+            params={"wait": 30},
+            timeout=40
+        )
         
         if response.status_code != 200:
             print(f"Error: {response.text}")
             return False
         
-        data = response.json()
-        status = data['status']
-        progress = data['progress']
-        
-        print(f"Status: {status} | Progress: {progress}%", end='\r')
-        
-        if status == 'completed':
-            print(f"\n✓ Generation completed successfully")
-            return True
-        elif status == 'failed':
-            print(f"\n✗ Generation failed: {data.get('error')}")
-            return False
-        
-        time.sleep(5)  # Poll every 5 seconds
-    
-    print(f"\n⚠ Generation timeout after {max_wait} seconds")
-    return False
+        result = report_status(response.json())
+        if result is not None:
+            return result
+    return None
 
 
-def test_download_music(generation_id):
-    """Test downloading generated music."""
-    print_section("Testing Music Download")
+async def test_status_transition(client, generation_id):
+    """Test that a generation job is recorded and long-polling sees its status change."""
+    print_section("Testing Status Transition")
     
     if not generation_id:
         print("⚠ Skipping - no generation_id")
         return
     
-    response = requests.get(f"{API_URL}/download/{generation_id}")
+    # The job is recorded as soon as its background task starts, which is
+    # right after the generate response is sent
+    for _ in range(10):
+        response = await client.get(f"{API_URL}/status/{generation_id}")
+        if response.status_code != 404:
+            break
+        await asyncio.sleep(0.5)
     
     print(f"Status Code: {response.status_code}")
+    assert response.status_code == 200, f"Generation job not recorded: {response.text}"
+    before = response.json()
     
-    if response.status_code == 200:
-        output_file = f"generated_{generation_id}.wav"
-        with open(output_file, 'wb') as f:
-            f.write(response.content)
+    if before['status'] in ('completed', 'failed'):
+        print(f"✓ Job already finished ({before['status']})")
+        return
+    
+    # Long-poll until the recorded status or progress moves on
+    max_wait = 300
+    start_time = time.time()
+    after = before
+    while time.time() - start_time < max_wait:
+        response = await client.get(
+            f"{API_URL}/status/{generation_id}",
+            params={"wait": 30},
+            timeout=40
+        )
+        assert response.status_code == 200, f"Status lookup failed: {response.text}"
+        after = response.json()
+        if (after['status'], after['progress']) != (before['status'], before['progress']):
+            break
+    
+    assert (after['status'], after['progress']) != (before['status'], before['progress']), \
+        f"No status change within {max_wait} seconds"
+    print(f"✓ Status moved from {before['status']} ({before['progress']}%) "
+          f"to {after['status']} ({after['progress']}%)")
+
+
+async def test_generation_status(client, generation_id):
+    """Test generation status updates (WebSocket push, long-poll fallback)."""
+    print_section("Testing Generation Status")
+    
+    if not generation_id:
+        print("⚠ Skipping - no generation_id")
+        return False
+    
+    max_wait = 300  # 5 minutes
+    
+    try:
+        result = await watch_status_ws(generation_id, max_wait)
+    except Exception as e:
+        print(f"WebSocket unavailable ({e}), falling back to long-polling")
+        result = await watch_status_long_poll(client, generation_id, max_wait)
+    
+    if result is None:
+        print(f"\n⚠ Generation timeout after {max_wait} seconds")
+        return False
+    return result
+
+
+async def test_download_music(client, generation_id):
+    """Test downloading generated music."""
+    print_section("Testing Music Download")
+    
+    if not generation_id:
+        print("⚠ Skipping - no generation_id")
+        return
+    
+    # Stream the body straight to disk instead of buffering it in memory
+    async with client.stream("GET", f"{API_URL}/download/{generation_id}") as response:
+        print(f"Status Code: {response.status_code}")
         
-        file_size = os.path.getsize(output_file)
-        print(f"✓ Music downloaded successfully: {output_file}")
-        print(f"  File size: {file_size / 1024 / 1024:.2f} MB")
-    else:
-        print(f"Error: {response.text}")
+        if response.status_code == 200:
+            output_file = f"generated_{generation_id}.wav"
+            with open(output_file, 'wb') as f:
+                async for chunk in response.aiter_bytes(chunk_size=1 << 20):
+                    f.write(chunk)
+            
+            file_size = os.path.getsize(output_file)
+            print(f"✓ Music downloaded successfully: {output_file}")
+            print(f"  File size: {file_size / 1024 / 1024:.2f} MB")
+        else:
+            await response.aread()
+            print(f"Error: {response.text}")
 
 
-def run_full_test():
+async def run_full_test():
     """Run complete test suite."""
     print("\n" + "🎵" * 30)
     print("  Music Generation Backend - Test Suite")
     print("🎵" * 30)
     
-    try:
-        # Test 1: Health check
-        test_health_check()
-        
-        # Test 2: Upload audio
-        audio_id = test_upload_audio()
-        
-        if audio_id:
-            # Test 3: Get embedding
-            test_get_embedding(audio_id)
-            
-            # Test 4: Analyze audio
-            test_analyze_audio(audio_id)
+    async with httpx.AsyncClient(limits=CLIENT_LIMITS, timeout=None) as client:
+        try:
+            # Test 1: Health check
+            await test_health_check(client)
             
-            # Test 5: Generate music
-            generation_id = test_generate_music(audio_id)
+            # Test 2: Upload audio
+            audio_id = await test_upload_audio(client)
             
-            if generation_id:
-                # Test 6: Poll generation status
-                completed = test_generation_status(generation_id)
+            if audio_id:
+                # Tests 3 and 4: embedding and analysis are independent, run them concurrently
+                await asyncio.gather(
+                    test_get_embedding(client, audio_id),
+                    test_analyze_audio(client, audio_id)
+                )
                 
-                if completed:
-                    # Test 7: Download generated music
-                    test_download_music(generation_id)
+                # Test 5: Generate music
+                generation_id = await test_generate_music(client, audio_id)
+                
+                if generation_id:
+                    # Test 6: Job is recorded and its status changes
+                    await test_status_transition(client, generation_id)
+                    
+                    # Test 7: Follow generation status
+                    completed = await test_generation_status(client, generation_id)
+                    
+                    if completed:
+                        # Test 8: Download generated music
+                        await test_download_music(client, generation_id)
+            
+            print_section("Test Suite Completed")
+            print("✓ All tests passed!")
         
-        print_section("Test Suite Completed")
-        print("✓ All tests passed!")
-    
-    except Exception as e:
-        print(f"\n✗ Test failed with error: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        except Exception as e:
+            print(f"\n✗ Test failed with error: {str(e)}")
+            import traceback
+            traceback.print_exc()
 
 
-def quick_test():
+async def quick_test():
     """Quick test without full music generation."""
     print("\n" + "🎵" * 30)
     print("  Music Generation Backend - Quick Test")
     print("🎵" * 30)
     
-    try:
-        # Test health check
-        test_health_check()
-        
-        # Test upload
-        audio_id = test_upload_audio()
-        
-        if audio_id:
-            # Test analysis
-            test_analyze_audio(audio_id)
+    async with httpx.AsyncClient(limits=CLIENT_LIMITS, timeout=None) as client:
+        try:
+            # Test health check
+            await test_health_check(client)
             
-            print_section("Quick Test Completed")
-            print("✓ Quick tests passed!")
-            print(f"\nTo test music generation, run:")
-            print(f"  python tests/test_api.py --full")
-    
-    except Exception as e:
-        print(f"\n✗ Test failed with error: {str(e)}")
-        import traceback
-        traceback.print_exc()
+            # Test upload
+            audio_id = await test_upload_audio(client)
+            
+            if audio_id:
+                # Test analysis
+                await test_analyze_audio(client, audio_id)
+                
+                print_section("Quick Test Completed")
+                print("✓ Quick tests passed!")
+                print(f"\nTo test music generation, run:")
+                print(f"  python tests/test_api.py --full")
+        
+        except Exception as e:
+            print(f"\n✗ Test failed with error: {str(e)}")
+            import traceback
+            traceback.print_exc()
 
 
 if __name__ == "__main__":
     import sys
     
     if "--full" in sys.argv:
-        run_full_test()
+        asyncio.run(run_full_test())
     else:
         print("\nRunning quick test (without music generation)")
         print("For full test including music generation, use: --full")
         print()
-        quick_test()
+        asyncio.run(quick_test())
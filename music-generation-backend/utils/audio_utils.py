@@ -3,9 +3,58 @@
 import librosa
 import soundfile as sf
 import numpy as np
+import scipy.fft
 from typing import Tuple, Optional
+import base64
+import functools
 import os
 
+try:
+    import soxr
+except ImportError:
+    soxr = None
+
+# Bump whenever extract_audio_features or pack_features changes its output,
+# so cached feature sets computed by older code are not reused
+FEATURES_VERSION = 2
+
+
+class _ThreadedFFT:
+    """scipy.fft proxy that runs every transform on a fixed number of threads."""
+    
+    _TRANSFORMS = {"fft", "ifft", "rfft", "irfft", "fftn", "ifftn", "rfftn", "irfftn"}
+    
+    def __init__(self, workers: int):
+        self.workers = workers
+    
+    def __getattr__(self, name):
+        func = getattr(scipy.fft, name)
+        if name in self._TRANSFORMS:
+            return functools.partial(func, workers=self.workers)
+        return func
+
+
+def configure_fft_backend(workers: int = -1):
+    """
+    Point librosa at a multi-threaded FFT: pyFFTW if installed, else scipy.fft.
+    
+    Args:
+        workers: FFT threads per transform (-1 for all cores)
+    """
+    try:
+        import pyfftw
+        import pyfftw.interfaces.numpy_fft
+    except ImportError:
+        librosa.set_fftlib(_ThreadedFFT(workers))
+        return
+    
+    pyfftw.config.NUM_THREADS = workers if workers > 0 else (os.cpu_count() or 1)
+    pyfftw.interfaces.cache.enable()
+    librosa.set_fftlib(pyfftw.interfaces.numpy_fft)
+
+
+configure_fft_backend()
+
 
 def load_audio(file_path: str, sr: int = 22050) -> Tuple[np.ndarray, int]:
     """
@@ -19,12 +68,42 @@ def load_audio(file_path: str, sr: int = 22050) -> Tuple[np.ndarray, int]:
         Tuple of (audio_array, sample_rate)
     """
     try:
-        audio, sample_rate = librosa.load(file_path, sr=sr, mono=True)
-        return audio, sample_rate
+        try:
+            # Decode with libsndfile directly as float32; only formats it
+            # cannot read go through librosa's audioread fallback
+            audio, native_sr = sf.read(file_path, dtype="float32", always_2d=False)
+        except RuntimeError:
+            audio, native_sr = librosa.load(file_path, sr=None, mono=True, dtype=np.float32)
+        
+        if audio.ndim > 1:
+            audio = audio.mean(axis=1, dtype=np.float32)
+        
+        return resample_audio(audio, native_sr, sr), sr
     except Exception as e:
         raise ValueError(f"Failed to load audio file: {str(e)}")
 
 
+def resample_audio(audio: np.ndarray, orig_sr: int, target_sr: int) -> np.ndarray:
+    """
+    Resample audio with soxr, falling back to librosa if soxr is unavailable.
+    
+    Args:
+        audio: Audio array
+        orig_sr: Sample rate of the input
+        target_sr: Target sample rate
+    
+    Returns:
+        Resampled float32 audio array
+    """
+    if orig_sr == target_sr:
+        return audio
+    
+    audio = np.ascontiguousarray(audio, dtype=np.float32)
+    if soxr is not None:
+        return soxr.resample(audio, orig_sr, target_sr, quality="HQ")
+    return librosa.resample(audio, orig_sr=orig_sr, target_sr=target_sr)
+
+
 def get_audio_info(file_path: str) -> dict:
     """
     Extract basic audio file information.
@@ -60,20 +139,35 @@ def extract_audio_features(audio: np.ndarray, sr: int = 22050) -> dict:
     Returns:
         Dictionary of audio features
     """
+    # Contiguous float32 keeps the FFTs on their vectorized single-precision path
+    audio = np.ascontiguousarray(audio, dtype=np.float32)
     features = {}
     
-    # Spectral features
-    spectral_centroids = librosa.feature.spectral_centroid(y=audio, sr=sr)[0]
-    spectral_rolloff = librosa.feature.spectral_rolloff(y=audio, sr=sr)[0]
-    spectral_bandwidth = librosa.feature.spectral_bandwidth(y=audio, sr=sr)[0]
+    # Shared spectrogram: the spectral, rhythm, MFCC and chroma features below
+    # all reuse this one STFT instead of each recomputing it from the signal
+    D = librosa.stft(audio, n_fft=2048, hop_length=512)
+    S_pow = np.square(D.real)
+    S_pow += np.square(D.imag)
+    del D
+    S = np.sqrt(S_pow)
+    
+    # Spectral features (magnitude spectrogram, as when computed from y)
+    spectral_centroids = librosa.feature.spectral_centroid(S=S, sr=sr)[0]
+    spectral_rolloff = librosa.feature.spectral_rolloff(S=S, sr=sr)[0]
+    spectral_bandwidth = librosa.feature.spectral_bandwidth(S=S, sr=sr)[0]
     
     features['spectral_centroid_mean'] = float(np.mean(spectral_centroids))
     features['spectral_centroid_std'] = float(np.std(spectral_centroids))
     features['spectral_rolloff_mean'] = float(np.mean(spectral_rolloff))
     features['spectral_bandwidth_mean'] = float(np.mean(spectral_bandwidth))
     
-    # Rhythm features
-    tempo, _ = librosa.beat.beat_track(y=audio, sr=sr)
+    # Log-mel of the shared power spectrogram, used by rhythm and MFCC features
+    log_mel = librosa.power_to_db(librosa.feature.melspectrogram(S=S_pow, sr=sr))
+    
+    # Rhythm features; the onset envelope is built from the shared log-mel
+    # exactly as beat_track would, minus its internal STFT
+    onset_env = librosa.onset.onset_strength(S=log_mel, sr=sr, aggregate=np.median)
+    tempo, _ = librosa.beat.beat_track(onset_envelope=onset_env, sr=sr)
     features['tempo'] = float(tempo)
     
     # Zero crossing rate
@@ -81,12 +175,12 @@ def extract_audio_features(audio: np.ndarray, sr: int = 22050) -> dict:
     features['zero_crossing_rate_mean'] = float(np.mean(zcr))
     
     # MFCC features
-    mfccs = librosa.feature.mfcc(y=audio, sr=sr, n_mfcc=13)
-    for i in range(13):
-        features[f'mfcc_{i}_mean'] = float(np.mean(mfccs[i]))
+    mfccs = librosa.feature.mfcc(S=log_mel, n_mfcc=13)
+    mfcc_means = mfccs.mean(axis=1)
+    features.update({f'mfcc_{i}_mean': float(m) for i, m in enumerate(mfcc_means)})
     
-    # Chroma features
-    chroma = librosa.feature.chroma_stft(y=audio, sr=sr)
+    # Chroma features (chroma_stft expects a power spectrogram)
+    chroma = librosa.feature.chroma_stft(S=S_pow, sr=sr)
     features['chroma_mean'] = float(np.mean(chroma))
     
     # RMS energy
@@ -97,6 +191,70 @@ def extract_audio_features(audio: np.ndarray, sr: int = 22050) -> dict:
     return features
 
 
+def pack_features(features: dict) -> dict:
+    """
+    Compact a feature dictionary for storage.
+    
+    Each MFCC mean is stored as an int8 mantissa with its own int8
+    power-of-two exponent (about 1% relative precision, whatever the
+    coefficient's magnitude), base64-encoded under 'mfcc_q'; every other
+    feature is kept as is.
+    
+    Args:
+        features: Features as returned by extract_audio_features
+    
+    Returns:
+        Storable feature dictionary (see unpack_features)
+    """
+    n_mfcc = 0
+    while f'mfcc_{n_mfcc}_mean' in features:
+        n_mfcc += 1
+    if n_mfcc == 0:
+        return features
+    
+    means = np.array([features[f'mfcc_{i}_mean'] for i in range(n_mfcc)], dtype=np.float64)
+    # Smallest exponent that fits each coefficient's mantissa in [-127, 127]
+    magnitude = np.abs(means)
+    exponents = np.zeros(n_mfcc, dtype=np.int32)
+    nonzero = magnitude > 0
+    exponents[nonzero] = np.clip(np.ceil(np.log2(magnitude[nonzero] / 127)), -128, 127)
+    quantized = np.clip(np.round(np.ldexp(means, -exponents)), -127, 127).astype(np.int8)
+    
+    packed = {
+        key: value for key, value in features.items()
+        if not (key.startswith('mfcc_') and key.endswith('_mean'))
+    }
+    packed['mfcc_q'] = {
+        'exps': base64.b64encode(exponents.astype(np.int8).tobytes()).decode('ascii'),
+        'bytes': base64.b64encode(quantized.tobytes()).decode('ascii')
+    }
+    return packed
+
+
+def unpack_features(features: Optional[dict]) -> Optional[dict]:
+    """
+    Restore a feature dictionary written by pack_features.
+    
+    Dictionaries stored before packing was introduced pass through unchanged.
+    
+    Args:
+        features: Stored feature dictionary
+    
+    Returns:
+        Feature dictionary with per-coefficient 'mfcc_{i}_mean' entries
+    """
+    if not features or 'mfcc_q' not in features:
+        return features
+    
+    unpacked = dict(features)
+    packed = unpacked.pop('mfcc_q')
+    quantized = np.frombuffer(base64.b64decode(packed['bytes']), dtype=np.int8).astype(np.float64)
+    exponents = np.frombuffer(base64.b64decode(packed['exps']), dtype=np.int8).astype(np.int32)
+    means = np.ldexp(quantized, exponents)
+    unpacked.update({f'mfcc_{i}_mean': float(m) for i, m in enumerate(means)})
+    return unpacked
+
+
 def save_audio(audio: np.ndarray, file_path: str, sr: int = 32000):
     """
     Save audio array to file.
@@ -123,22 +281,61 @@ def validate_audio_file(file_path: str, max_duration: int = 300) -> bool:
     Returns:
         True if valid, raises ValueError otherwise
     """
+    try:
+        # Header-only open; a missing or unreadable file raises here too
+        with sf.SoundFile(file_path) as f:
+            _check_duration(f.frames / f.samplerate, max_duration)
+        return True
+    
+    except Exception as e:
+        raise ValueError(f"Invalid audio file: {str(e)}")
+
+
+def _check_duration(duration: float, max_duration: int):
+    """Raise ValueError if a duration is outside the accepted range."""
+    if duration > max_duration:
+        raise ValueError(f"Audio duration ({duration}s) exceeds maximum ({max_duration}s)")
+    
+    if duration < 1:
+        raise ValueError("Audio duration must be at least 1 second")
+
+
+def open_audio(file_path: str, sr: int = 22050, max_duration: int = 300) -> Tuple[np.ndarray, dict]:
+    """
+    Validate, inspect and load an audio file through a single open.
+    
+    Validation uses the header alone, so files that fail it are never decoded.
+    
+    Args:
+        file_path: Path to audio file
+        sr: Target sample rate (default: 22050)
+        max_duration: Maximum allowed duration in seconds
+    
+    Returns:
+        Tuple of (audio_array, info) with info as returned by get_audio_info
+    """
     if not os.path.exists(file_path):
         raise ValueError("File does not exist")
     
     try:
-        info = get_audio_info(file_path)
-        
-        if info['duration'] > max_duration:
-            raise ValueError(f"Audio duration ({info['duration']}s) exceeds maximum ({max_duration}s)")
-        
-        if info['duration'] < 1:
-            raise ValueError("Audio duration must be at least 1 second")
-        
-        return True
-    
+        with sf.SoundFile(file_path) as f:
+            info = {
+                "duration": f.frames / f.samplerate,
+                "sample_rate": f.samplerate,
+                "channels": f.channels,
+                "format": f.format,
+                "subtype": f.subtype,
+                "frames": f.frames
+            }
+            _check_duration(info["duration"], max_duration)
+            audio = f.read(dtype="float32", always_2d=False)
     except Exception as e:
         raise ValueError(f"Invalid audio file: {str(e)}")
+    
+    if audio.ndim > 1:
+        audio = audio.mean(axis=1, dtype=np.float32)
+    
+    return resample_audio(audio, info["sample_rate"], sr), info
 
 
 def normalize_audio(audio: np.ndarray, target_db: float = -20.0) -> np.ndarray:
@@ -152,21 +349,26 @@ def normalize_audio(audio: np.ndarray, target_db: float = -20.0) -> np.ndarray:
     Returns:
         Normalized audio array
     """
-    # Calculate current RMS
-    rms = np.sqrt(np.mean(audio ** 2))
+    # Work in float32 like the rest of the pipeline (no copy if already float32)
+    audio = np.asarray(audio, dtype=np.float32)
+    if audio.size == 0:
+        return audio
+    
+    # Calculate current RMS (dot product: one pass, no squared temporary)
+    flat = audio.ravel()
+    rms = np.sqrt(float(np.dot(flat, flat)) / audio.size)
     
     if rms == 0:
         return audio
     
     # Calculate target RMS from dB
     target_rms = 10 ** (target_db / 20)
+    scale = target_rms / rms
     
-    # Normalize
-    normalized = audio * (target_rms / rms)
-    
-    # Prevent clipping
-    max_val = np.abs(normalized).max()
-    if max_val > 1.0:
-        normalized = normalized / max_val * 0.95
+    # Prevent clipping: the scaled peak is known up front, so the gain and
+    # the clip correction collapse into a single multiply
+    peak = max(float(audio.max()), -float(audio.min())) * scale
+    if peak > 1.0:
+        scale *= 0.95 / peak
     
-    return normalized
+    return np.multiply(audio, np.float32(scale))
@@ -2,10 +2,14 @@
 
 import os
 import shutil
-import json
-from typing import Optional, Dict
+import orjson
+import sqlite3
+import threading
+import time
+from typing import Optional, Dict, List
 from datetime import datetime
 import uuid
+import xxhash
 
 
 class LocalStorage:
@@ -36,7 +40,41 @@ class LocalStorage:
             filename = os.path.basename(source_path)
         
         destination = os.path.join(self.base_dir, filename)
-        shutil.copy2(source_path, destination)
+        try:
+            _copy_file_range(source_path, destination)
+            shutil.copystat(source_path, destination)
+        except (AttributeError, OSError):
+            # No copy_file_range (non-Linux, old kernel, cross-device on older
+            # kernels); shutil.copy2 still copies in-kernel via sendfile on Linux
+            shutil.copy2(source_path, destination)
+        return destination
+    
+    def save_bytes(self, data: bytes, filename: str, offset: int = 0) -> str:
+        """
+        Write bytes to a file in storage with unbuffered positional writes.
+        
+        Writing at offset 0 creates or truncates the file; larger offsets
+        extend it, so a stream can be stored chunk by chunk.
+        
+        Args:
+            data: Bytes-like object to write
+            filename: Filename
+            offset: Byte offset to write at
+        
+        Returns:
+            Saved file path
+        """
+        destination = os.path.join(self.base_dir, filename)
+        flags = os.O_WRONLY | os.O_CREAT | (os.O_TRUNC if offset == 0 else 0)
+        fd = os.open(destination, flags, 0o644)
+        try:
+            # pwrite straight from the caller's buffer, no buffered-IO copy
+            view = memoryview(data)
+            written = 0
+            while written < len(view):
+                written += os.pwrite(fd, view[written:], offset + written)
+        finally:
+            os.close(fd)
         return destination
     
     def get_file_path(self, filename: str) -> str:
@@ -52,44 +90,90 @@ class LocalStorage:
         return os.path.join(self.base_dir, filename)
 
 
+def _copy_file_range(source_path: str, destination: str):
+    """
+    Copy a file entirely in the kernel with copy_file_range.
+    
+    On reflink-capable filesystems (XFS, Btrfs) this shares extents instead
+    of copying data. Raises AttributeError or OSError when unsupported.
+    """
+    src_fd = os.open(source_path, os.O_RDONLY)
+    try:
+        dst_fd = os.open(destination, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            remaining = os.fstat(src_fd).st_size
+            while remaining > 0:
+                copied = os.copy_file_range(src_fd, dst_fd, remaining)
+                if copied == 0:
+                    break
+                remaining -= copied
+        finally:
+            os.close(dst_fd)
+    finally:
+        os.close(src_fd)
+
+
 class MetadataStore:
-    """Store and retrieve metadata as JSON files."""
+    """Store and retrieve metadata as JSON documents in a SQLite database."""
     
-    def __init__(self, base_dir: str):
+    def __init__(self, base_dir: str, db_name: str = "metadata.db"):
         """
         Initialize metadata store.
         
         Args:
-            base_dir: Base directory for metadata files
+            base_dir: Base directory for the metadata database
+            db_name: Database filename
         """
         self.base_dir = base_dir
         os.makedirs(base_dir, exist_ok=True)
+        self.db_path = os.path.join(base_dir, db_name)
+        
+        # One shared connection; WAL lets readers proceed alongside the writer
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS metadata "
+            "(id TEXT PRIMARY KEY, json TEXT NOT NULL, updated REAL)"
+        )
+        # Databases created before the updated column existed gain it in place
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(metadata)")}
+        if "updated" not in columns:
+            self.conn.execute("ALTER TABLE metadata ADD COLUMN updated REAL")
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS metadata_updated ON metadata (updated)"
+        )
+        self.conn.commit()
     
     def save_metadata(self, key: str, data: Dict) -> str:
         """
-        Save metadata to JSON file.
+        Save metadata under a key.
         
         Args:
-            key: Unique key (will be used as filename)
+            key: Unique key
             data: Dictionary data to save
         
         Returns:
-            Path to saved metadata file
+            Key the metadata was saved under
         """
-        filename = f"{key}.json"
-        filepath = os.path.join(self.base_dir, filename)
-        
         # Add timestamp
         data['updated_at'] = datetime.utcnow().isoformat()
         
-        with open(filepath, 'w') as f:
-            json.dump(data, f, indent=2)
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO metadata (id, json, updated) VALUES (?, ?, ?)",
+                (key, orjson.dumps(data), time.time())
+            )
         
-        return filepath
+        return key
     
     def load_metadata(self, key: str) -> Optional[Dict]:
         """
-        Load metadata from JSON file.
+        Load metadata for a key.
+        
+        Metadata written by older versions as {key}.json files is read and
+        migrated into the database on first access.
         
         Args:
             key: Unique key
@@ -97,16 +181,69 @@ class MetadataStore:
         Returns:
             Dictionary data or None if not found
         """
-        filename = f"{key}.json"
-        filepath = os.path.join(self.base_dir, filename)
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT json FROM metadata WHERE id = ?", (key,)
+            ).fetchone()
         
-        if not os.path.exists(filepath):
+        if row is not None:
+            return orjson.loads(row[0])
+        
+        legacy_path = os.path.join(self.base_dir, f"{key}.json")
+        if not os.path.exists(legacy_path):
             return None
         
-        with open(filepath, 'r') as f:
-            return json.load(f)
+        with open(legacy_path, 'rb') as f:
+            data = orjson.loads(f.read())
+        
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO metadata (id, json, updated) VALUES (?, ?, ?)",
+                (key, orjson.dumps(data), os.path.getmtime(legacy_path))
+            )
+        
+        return data
+    
+    def list_keys(self, prefix: Optional[str] = None) -> List[str]:
+        """
+        List stored keys, oldest update first.
+        
+        Args:
+            prefix: Only return keys starting with this prefix
+        
+        Returns:
+            List of keys
+        """
+        query = "SELECT id FROM metadata"
+        params = ()
+        if prefix:
+            # Range scan on the primary key instead of LIKE, which would need escaping
+            query += " WHERE id >= ? AND id < ?"
+            params = (prefix, prefix + "\uffff")
+        query += " ORDER BY updated"
+        
+        with self._lock:
+            return [row[0] for row in self.conn.execute(query, params)]
 
 
 def generate_unique_id() -> str:
-    """Generate a unique ID."""
-    return str(uuid.uuid4())
+    """Generate a unique ID (32 hex characters, no dashes)."""
+    return uuid.uuid4().hex
+
+
+def compute_file_hash(file_path: str, chunk_size: int = 1 << 20) -> str:
+    """
+    Compute a content hash of a file.
+    
+    Args:
+        file_path: Path to file
+        chunk_size: Read size in bytes
+    
+    Returns:
+        xxh3-64 hex digest of the file contents
+    """
+    hasher = xxhash.xxh3_64()
+    with open(file_path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            hasher.update(chunk)
+    return hasher.hexdigest()
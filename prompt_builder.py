@@ -2,7 +2,10 @@
 Prompt Builder Module for Levitate.
 Generates image prompts based on audio features.
 """
+import functools
 import random
+import sys
+from typing import Optional
 
 
 # Scene types based on mood and energy combinations
@@ -158,6 +161,17 @@ STYLE_OPTIONS = {
     "fast": "motion blur, extreme angles, kinetic energy",
 }
 
+# Palette prefix/suffix based on mood
+_MOOD_STYLE = {
+    "melancholic": ("muted ", " with deep shadows"),
+    "tense": ("muted ", " with deep shadows"),
+    "aggressive": ("intense ", " with stark contrasts"),
+    "driving": ("intense ", " with stark contrasts"),
+    "euphoric": ("vibrant ", " with luminous highlights"),
+    "bright": ("vibrant ", " with luminous highlights"),
+}
+_DEFAULT_MOOD_STYLE = ("", " with cinematic grading")
+
 # Weather/atmosphere options based on mood
 WEATHER_OPTIONS = {
     "melancholic": ["gentle rain", "thick fog", "overcast twilight", "autumn mist"],
@@ -172,91 +186,177 @@ WEATHER_OPTIONS = {
 }
 
 # Default fallback scenes
-DEFAULT_SCENES = [
+DEFAULT_SCENES = (
     "mystical landscape at twilight",
     "dramatic natural vista",
     "fantastical environment"
-]
+)
+
+# Scene lists as tuples: immutable and cheaper for random.choice to index
+SCENE_OPTIONS = {key: tuple(scenes) for key, scenes in SCENE_OPTIONS.items()}
+
+
+def _resolve_scenes(mood: str, energy: str) -> tuple:
+    """Find the scenes for a mood/energy pair, falling back to close matches."""
+    for m in [mood, "atmospheric"]:
+        for e in [energy, "medium"]:
+            if (m, e) in SCENE_OPTIONS:
+                return SCENE_OPTIONS[(m, e)]
+    
+    return DEFAULT_SCENES
+
+
+# Option tables keyed by interned labels, so lookups with the analyzer's
+# labels compare by identity after the hash check
+LIGHTING_OPTIONS = {sys.intern(k): v for k, v in LIGHTING_OPTIONS.items()}
+ATMOSPHERE_OPTIONS = {sys.intern(k): v for k, v in ATMOSPHERE_OPTIONS.items()}
+STYLE_OPTIONS = {sys.intern(k): v for k, v in STYLE_OPTIONS.items()}
+WEATHER_OPTIONS = {sys.intern(k): v for k, v in WEATHER_OPTIONS.items()}
+
+# Each label the analyzer can produce maps to a small int; unknown labels map
+# to one past the end, where every table below holds its fallback value
+_MOOD_ID = {mood: i for i, mood in enumerate(WEATHER_OPTIONS)}
+_ENERGY_ID = {energy: i for i, energy in enumerate(LIGHTING_OPTIONS)}
+_TEXTURE_ID = {texture: i for i, texture in enumerate(ATMOSPHERE_OPTIONS)}
+_TEMPO_ID = {tempo: i for i, tempo in enumerate(STYLE_OPTIONS)}
+_NO_MOOD = len(_MOOD_ID)
+_NO_ENERGY = len(_ENERGY_ID)
+_NO_TEXTURE = len(_TEXTURE_ID)
+_NO_TEMPO = len(_TEMPO_ID)
+
+# Option tables as tuples indexed by those ids. Scenes for every mood/energy
+# pair are resolved through the fallback chain once at import; the "" label
+# stands in for an unknown mood or energy.
+_SCENE_ARR = tuple(
+    tuple(_resolve_scenes(mood, energy) for energy in (*LIGHTING_OPTIONS, ""))
+    for mood in (*WEATHER_OPTIONS, "")
+)
+_WEATHER_ARR = (*(tuple(options) for options in WEATHER_OPTIONS.values()), ("dramatic sky",))
+
+
+def _flatten(table: tuple, flat: list, offsets: dict):
+    """Replace each option tuple in a (nested) table by its (start, n, bits) slot in flat."""
+    if table and isinstance(table[0], str):
+        slot = offsets.get(table)
+        if slot is None:
+            n = len(table)
+            # bits is set for power-of-two lengths, which _pick draws with getrandbits
+            bits = n.bit_length() - 1 if n & (n - 1) == 0 else None
+            slot = offsets[table] = (len(flat), n, bits)
+            flat.extend(table)
+        return slot
+    return tuple(_flatten(row, flat, offsets) for row in table)
+
 
+# Every scene and weather option laid out once in a single flat tuple; the
+# tables above become (start, n, bits) slots into it. Fallback pairs that
+# share a scene list share its slot.
+_flat, _offsets = [], {}
+_SCENE_OFF = _flatten(_SCENE_ARR, _flat, _offsets)
+_WEATHER_OFF = _flatten(_WEATHER_ARR, _flat, _offsets)
+_OPTIONS_FLAT = tuple(_flat)
+del _flat, _offsets, _SCENE_ARR, _WEATHER_ARR
 
-def build_prompt(features: dict) -> str:
+_MOOD_STYLE_ARR = (
+    *(_MOOD_STYLE.get(mood, _DEFAULT_MOOD_STYLE) for mood in WEATHER_OPTIONS),
+    _DEFAULT_MOOD_STYLE,
+)
+_LIGHT_ARR = (*LIGHTING_OPTIONS.values(), "cinematic lighting")
+_ATMOS_ARR = (*ATMOSPHERE_OPTIONS.values(), "atmospheric perspective")
+_STYLE_ARR = (*STYLE_OPTIONS.values(), "cinematic composition")
+
+
+# Literal fragments of the prompt template, interleaved with the selected
+# scene, weather, colors, lighting, atmosphere and style by build_prompt
+_TPL = (
+    ", ",
+    ".\nColor palette: ",
+    ".\nLighting: ",
+    ".\nAtmosphere: ",
+    ".\nStyle: ",
+    ".\nUltra detailed digital art, 8K resolution, trending on ArtStation."
+    "\nCinematic wide shot, professional concept art, no text, no watermark, no signature.",
+)
+
+
+def build_prompt(features: dict, seed: Optional[int] = None) -> str:
     """
     Build an image generation prompt based on audio features.
     
     Args:
         features: Dictionary of audio features from analyze_audio()
+        seed: Seed for the scene/weather picks. With a seed the prompt is
+            reproducible and memoized per feature set; without one every
+            call draws fresh choices.
         
     Returns:
         A detailed prompt string for image generation
     """
-    tempo = features["tempo"]
-    tempo_class = features["tempo_class"]
-    energy = features["energy"]
-    mood = features["mood"]
-    texture = features["texture"]
-    dominant_pitch = features["dominant_pitch"]
+    key = (
+        features["tempo_class"],
+        features["energy"],
+        features["mood"],
+        features["texture"],
+        features["dominant_pitch"],
+    )
+    if seed is None:
+        return _compose_prompt(*key, random)
+    return _build_prompt_cached(*key, seed)
+
+
+@functools.lru_cache(maxsize=1024)
+def _build_prompt_cached(tempo_class: str, energy: str, mood: str, texture: str,
+                         dominant_pitch: int, seed: int) -> str:
+    """Seeded, memoized build_prompt for repeated feature sets."""
+    return _compose_prompt(tempo_class, energy, mood, texture, dominant_pitch, random.Random(seed))
+
+
+def _compose_prompt(tempo_class: str, energy: str, mood: str, texture: str,
+                    dominant_pitch: int, rng) -> str:
+    """Assemble the prompt, drawing the random picks from rng."""
+    # One dict lookup per label, then plain tuple indexing
+    mood_id = _MOOD_ID.get(mood, _NO_MOOD)
+    energy_id = _ENERGY_ID.get(energy, _NO_ENERGY)
     
     # Select scene
-    scene = _select_scene(mood, energy)
+    scene = _pick(_SCENE_OFF[mood_id][energy_id], rng)
     
     # Build color style
-    color_style = _build_color_style(dominant_pitch, mood)
+    color_style = _build_color_style(dominant_pitch, mood_id)
     
     # Get lighting
-    lighting = LIGHTING_OPTIONS.get(energy, "cinematic lighting")
+    lighting = _LIGHT_ARR[energy_id]
     
     # Get atmosphere
-    atmosphere = ATMOSPHERE_OPTIONS.get(texture, "atmospheric perspective")
+    atmosphere = _ATMOS_ARR[_TEXTURE_ID.get(texture, _NO_TEXTURE)]
     
     # Get style
-    style = STYLE_OPTIONS.get(tempo_class, "cinematic composition")
+    style = _STYLE_ARR[_TEMPO_ID.get(tempo_class, _NO_TEMPO)]
     
     # Get weather
-    weather = _select_weather(mood)
+    weather = _pick(_WEATHER_OFF[mood_id], rng)
 
-    prompt = f"""{scene}, {weather}.
-Color palette: {color_style}.
-Lighting: {lighting}.
-Atmosphere: {atmosphere}.
-Style: {style}.
-Ultra detailed digital art, 8K resolution, trending on ArtStation.
-Cinematic wide shot, professional concept art, no text, no watermark, no signature."""
+    return "".join((
+        scene, _TPL[0], weather,
+        _TPL[1], color_style,
+        _TPL[2], lighting,
+        _TPL[3], atmosphere,
+        _TPL[4], style,
+        _TPL[5],
+    ))
 
-    return prompt.strip()
 
+def _pick(slot: tuple, rng) -> str:
+    """Pick a random option from a (start, n, bits) slot of _OPTIONS_FLAT."""
+    start, n, bits = slot
+    # Power-of-two lengths (most tables here) skip choice()'s rejection loop
+    if bits is not None:
+        return _OPTIONS_FLAT[start + rng.getrandbits(bits)]
+    return _OPTIONS_FLAT[start + rng.randrange(n)]
 
-def _select_scene(mood: str, energy: str) -> str:
-    """Select a scene based on mood and energy."""
-    key = (mood, energy)
-    
-    # Try exact match first
-    if key in SCENE_OPTIONS:
-        return random.choice(SCENE_OPTIONS[key])
-    
-    # Try to find a close match
-    for m in [mood, "atmospheric"]:
-        for e in [energy, "medium"]:
-            if (m, e) in SCENE_OPTIONS:
-                return random.choice(SCENE_OPTIONS[(m, e)])
-    
-    return random.choice(DEFAULT_SCENES)
 
-
-def _build_color_style(dominant_pitch: int, mood: str) -> str:
+def _build_color_style(dominant_pitch: int, mood_id: int) -> str:
     """Build color style based on musical key and mood."""
     base_palette = COLOR_PALETTES.get(dominant_pitch, "rich jewel tones")
-    
-    if mood in ["melancholic", "tense"]:
-        return f"muted {base_palette} with deep shadows"
-    elif mood in ["aggressive", "driving"]:
-        return f"intense {base_palette} with stark contrasts"
-    elif mood in ["euphoric", "bright"]:
-        return f"vibrant {base_palette} with luminous highlights"
-    else:
-        return f"{base_palette} with cinematic grading"
-
-
-def _select_weather(mood: str) -> str:
-    """Select weather/atmosphere based on mood."""
-    options = WEATHER_OPTIONS.get(mood, ["dramatic sky"])
-    return random.choice(options)
+    prefix, suffix = _MOOD_STYLE_ARR[mood_id]
+    return f"{prefix}{base_palette}{suffix}"
@@ -2,105 +2,252 @@
 Frontend server for Levitate API.
 Run with: uvicorn server:app --reload --port 8000
 """
-from fastapi import FastAPI, Query
+from fastapi import FastAPI, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, RedirectResponse
+from fastapi.responses import ORJSONResponse, RedirectResponse
+from collections import OrderedDict
 from typing import Optional
+import asyncio
+import hashlib
 import os
+import threading
+import time
 
 # Import the main API app
-from levitate import app as api_app, s3, S3_BUCKET, S3_COVER_BUCKET, logger
+from levitate import app as api_app, s3, S3_BUCKET, S3_COVER_BUCKET, logger, on_bucket_change
 
 # ---------------- APP ----------------
-app = FastAPI(title="Levitate Frontend", version="1.0")
+# Responses only carry str/int/bool/None values, which orjson serializes natively
+app = FastAPI(title="Levitate Frontend", version="1.0", default_response_class=ORJSONResponse)
 
-# Enable CORS
+# Enable CORS. FRONTEND_ORIGINS is a comma-separated list of allowed origins;
+# an explicit list is matched by set membership and may send credentials,
+# while the "*" default allows any origin without them.
+FRONTEND_ORIGINS = [
+    origin.strip() for origin in os.getenv("FRONTEND_ORIGINS", "*").split(",") if origin.strip()
+]
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
+    allow_origins=FRONTEND_ORIGINS,
+    allow_credentials="*" not in FRONTEND_ORIGINS,
     allow_methods=["*"],
     allow_headers=["*"],
 )
 
 # ---------------- HELPER FUNCTIONS ----------------
+# Presigned URLs keyed by (bucket, key, expires_in) -> (reuse_until, url).
+# URLs are reused for part of their lifetime, so clients always get one
+# with at least (1 - ttl_frac) of its validity left.
+_PRESIGN_CACHE_SIZE = 4096
+_presign_cache: OrderedDict = OrderedDict()
+_presign_lock = threading.Lock()
+_COVER_URL_TTL = 604800  # 7 days
+
+# /music listings by bucket, so polls skip the S3 listings. Writes made
+# through this app drop the cache at once (see on_bucket_change); the TTL
+# only bounds staleness for objects written by anything else.
+_LIST_CACHE_TTL = 60.0
+_list_cache = {}
+_list_generation = 0  # bumped on every drop; listings started earlier are not cached
+
+def _drop_listing_cache(bucket: str):
+    """Forget cached /music listings after a write to the music or cover bucket."""
+    global _list_generation
+    if bucket in (S3_BUCKET, S3_COVER_BUCKET):
+        _list_generation += 1
+        _list_cache.clear()
+
+on_bucket_change(_drop_listing_cache)
+
+def _sign(bucket: str, key: str, expires_in: int, ttl_frac: float = 0.5) -> str:
+    """Return a presigned GET URL, reusing a cached one while it is fresh."""
+    cache_key = (bucket, key, expires_in)
+    now = time.time()
+    
+    with _presign_lock:
+        cached = _presign_cache.get(cache_key)
+        if cached is not None and now < cached[0]:
+            _presign_cache.move_to_end(cache_key)
+            return cached[1]
+    
+    url = s3.generate_presigned_url(
+        'get_object',
+        Params={'Bucket': bucket, 'Key': key},
+        ExpiresIn=expires_in
+    )
+    
+    with _presign_lock:
+        _presign_cache[cache_key] = (now + expires_in * ttl_frac, url)
+        _presign_cache.move_to_end(cache_key)
+        if len(_presign_cache) > _PRESIGN_CACHE_SIZE:
+            _presign_cache.popitem(last=False)
+    return url
+
 def get_music_id(s3_key: str) -> str:
     """Get a unique ID for a music file (filename without extension)."""
-    return os.path.splitext(s3_key)[0]
+    # Same result as os.path.splitext(s3_key)[0] for "/"-separated keys,
+    # which is how levitate names the covers, in a single reverse scan
+    head, dot, ext = s3_key.rpartition(".")
+    if dot and "/" not in ext and head[head.rfind("/") + 1:].strip("."):
+        return head
+    return s3_key
+
+def _cover_music_id(cover_key: str) -> Optional[str]:
+    """Recover the music ID from a cover key ({music_id}_{YYYYmmdd}_{HHMMSS}_{uid}.png)."""
+    parts = os.path.splitext(cover_key)[0].rsplit("_", 3)
+    return parts[0] if len(parts) == 4 else None
+
+def _index_covers(prefix: str = "") -> dict:
+    """Map each music ID to its most recently modified cover object, in one listing."""
+    index = {}
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=S3_COVER_BUCKET, Prefix=prefix):
+        for obj in page.get("Contents", ()):
+            music_id = _cover_music_id(obj["Key"])
+            if music_id is None:
+                continue
+            # Running max instead of sorting every cover
+            latest = index.get(music_id)
+            if latest is None or obj["LastModified"] > latest["LastModified"]:
+                index[music_id] = obj
+    return index
+
+def _cover_info(cover: dict) -> dict:
+    """Presign a cover object and describe it for the frontend."""
+    presigned_url = _sign(S3_COVER_BUCKET, cover["Key"], _COVER_URL_TTL)
+    
+    return {
+        "key": cover["Key"],
+        "url": presigned_url,
+        "last_modified": cover["LastModified"].isoformat()
+    }
 
 def get_image_for_music(music_key: str) -> Optional[dict]:
     """Find the latest generated image for a music file."""
     music_id = get_music_id(music_key)
     
     try:
-        # List all images in the cover bucket that match this music ID
-        response = s3.list_objects_v2(
-            Bucket=S3_COVER_BUCKET,
-            Prefix=f"{music_id}_"
-        )
+        # List only this music ID's covers
+        latest_image = _index_covers(prefix=f"{music_id}_").get(music_id)
         
-        if "Contents" not in response or len(response["Contents"]) == 0:
+        if latest_image is None:
             return None
         
-        # Sort by last modified to get the latest image
-        images = sorted(response["Contents"], key=lambda x: x["LastModified"], reverse=True)
-        latest_image = images[0]
-        
-        # Generate presigned URL for the image
-        presigned_url = s3.generate_presigned_url(
-            'get_object',
-            Params={'Bucket': S3_COVER_BUCKET, 'Key': latest_image["Key"]},
-            ExpiresIn=604800  # 7 days
-        )
-        
-        return {
-            "key": latest_image["Key"],
-            "url": presigned_url,
-            "last_modified": latest_image["LastModified"].isoformat()
-        }
+        return _cover_info(latest_image)
     except Exception as e:
         logger.exception(f"Failed to get image for music: {music_key}")
         return None
 
+def _list_tracks() -> list:
+    """List every mp3 object in the music bucket."""
+    # Page through the whole bucket; a single call stops at 1000 keys
+    paginator = s3.get_paginator("list_objects_v2")
+    return [
+        obj
+        for page in paginator.paginate(Bucket=S3_BUCKET, PaginationConfig={"PageSize": 1000})
+        for obj in page.get("Contents", ())
+        if obj["Key"].lower().endswith(".mp3")
+    ]
+
+def _index_covers_or_none() -> Optional[dict]:
+    """_index_covers, or None if the cover bucket cannot be listed."""
+    try:
+        return _index_covers()
+    except Exception:
+        logger.exception("Failed to list cover images")
+        return None
+
+def _listing_etag(tracks: list, cover_index: dict, now: float) -> str:
+    """Hash everything a /music response depends on into a strong ETag."""
+    hasher = hashlib.blake2b(digest_size=16)
+    # Cover URLs are signed for _COVER_URL_TTL and reused for half of it, so
+    # a URL handed out within one half-lifetime window outlives the window
+    hasher.update(str(int(now // (_COVER_URL_TTL // 2))).encode())
+    for obj in tracks:
+        cover = cover_index.get(get_music_id(obj["Key"]))
+        hasher.update(
+            f"\n{obj['Key']}:{obj['Size']}:{obj['LastModified'].isoformat()}:"
+            f"{cover['Key'] if cover else ''}".encode()
+        )
+    return f'"{hasher.hexdigest()}"'
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Check an If-None-Match header against the current ETag."""
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+def _describe_tracks(tracks: list, cover_index: dict) -> list:
+    """Build the /music file entries, signing only the covers that are returned."""
+    files = []
+    for obj in tracks:
+        music_id = get_music_id(obj["Key"])
+        cover = cover_index.get(music_id)
+        
+        files.append({
+            "key": obj["Key"],
+            "id": music_id,
+            "size": obj["Size"],
+            "last_modified": obj["LastModified"].isoformat(),
+            "has_image": cover is not None,
+            "image_url": _cover_info(cover)["url"] if cover else None
+        })
+    return files
+
 # ---------------- LIST MUSIC ENDPOINT ----------------
 @app.get("/music")
-def list_music():
+async def list_music(request: Request):
     """List all uploaded music files with their associated images."""
     try:
-        response = s3.list_objects_v2(Bucket=S3_BUCKET)
+        now = time.time()
+        entry = _list_cache.get(S3_BUCKET)
         
-        if "Contents" not in response:
-            return {"files": []}
+        if entry is None or now >= entry["expires"]:
+            generation = _list_generation
+            # boto3 is blocking: list both buckets concurrently off the event loop,
+            # one listing of the cover bucket instead of one request per track
+            tracks, cover_index = await asyncio.gather(
+                asyncio.to_thread(_list_tracks),
+                asyncio.to_thread(_index_covers_or_none)
+            )
+            # Without covers the listing still works, but is not worth caching
+            if cover_index is None:
+                cover_index = {}
+                generation = None
+            
+            # S3 lists in key order; sort by last modified (newest first)
+            tracks.sort(key=lambda obj: obj["LastModified"], reverse=True)
+            
+            entry = {
+                "expires": now + _LIST_CACHE_TTL,
+                "etag": _listing_etag(tracks, cover_index, now),
+                "tracks": tracks,
+                "covers": cover_index,
+                "files": None
+            }
+            if generation == _list_generation:
+                _list_cache[S3_BUCKET] = entry
         
-        files = []
-        for obj in response["Contents"]:
-            if obj["Key"].lower().endswith(".mp3"):
-                music_id = get_music_id(obj["Key"])
-                image_info = get_image_for_music(obj["Key"])
-                
-                files.append({
-                    "key": obj["Key"],
-                    "id": music_id,
-                    "size": obj["Size"],
-                    "last_modified": obj["LastModified"].isoformat(),
-                    "has_image": image_info is not None,
-                    "image_url": image_info["url"] if image_info else None
-                })
+        # Clients must revalidate, but an unchanged listing costs them a 304
+        headers = {"ETag": entry["etag"], "Cache-Control": "no-cache"}
+        if _etag_matches(request.headers.get("if-none-match"), entry["etag"]):
+            return Response(status_code=304, headers=headers)
         
-        # Sort by last modified (newest first)
-        files.sort(key=lambda x: x["last_modified"], reverse=True)
+        if entry["files"] is None:
+            entry["files"] = _describe_tracks(entry["tracks"], entry["covers"])
         
-        return {"files": files}
+        return ORJSONResponse({"files": entry["files"]}, headers=headers)
     except Exception as e:
         logger.exception("Failed to list music files")
         return {"files": [], "error": str(e)}
 
 # ---------------- GET IMAGE FOR MUSIC ----------------
 @app.get("/music/image/{s3_key:path}")
-def get_music_image(s3_key: str):
+async def get_music_image(s3_key: str):
     """Get the existing generated image for a music file."""
-    image_info = get_image_for_music(s3_key)
+    image_info = await asyncio.to_thread(get_image_for_music, s3_key)
     
     if image_info:
         return {"exists": True, **image_info}
@@ -109,15 +256,12 @@ def get_music_image(s3_key: str):
 
 # ---------------- PLAY MUSIC ENDPOINT ----------------
 @app.get("/music/play/{s3_key:path}")
-def get_music_url(s3_key: str):
+async def get_music_url(s3_key: str):
     """Get a presigned URL to play music."""
     try:
         logger.info(f"Getting presigned URL for: {s3_key}")
-        presigned_url = s3.generate_presigned_url(
-            'get_object',
-            Params={'Bucket': S3_BUCKET, 'Key': s3_key},
-            ExpiresIn=3600  # 1 hour
-        )
+        # Signing is local (no S3 round trip), so it stays on the event loop
+        presigned_url = _sign(S3_BUCKET, s3_key, 3600)  # 1 hour
         logger.info(f"Generated presigned URL successfully")
         return {"url": presigned_url}
     except Exception as e:
@@ -125,12 +269,20 @@ def get_music_url(s3_key: str):
         return {"error": str(e)}
 
 # ---------------- STATIC FILES ----------------
-@app.get("/")
-def serve_frontend():
-    return FileResponse("static/index.html")
+_STATIC_MAX_AGE = 300  # seconds clients reuse the frontend before revalidating
+
+class CachedStaticFiles(StaticFiles):
+    """StaticFiles (sendfile, ETag/Last-Modified, 304s) plus a short Cache-Control max-age."""
+    def file_response(self, *args, **kwargs):
+        response = super().file_response(*args, **kwargs)
+        response.headers.setdefault("Cache-Control", f"public, max-age={_STATIC_MAX_AGE}")
+        return response
 
 # Mount static files (CSS, JS, images)
-app.mount("/static", StaticFiles(directory="static"), name="static")
+app.mount("/static", CachedStaticFiles(directory="static"), name="static")
 
-# Mount the API last to avoid conflicts
+# Mount the API before the frontend's catch-all mount
 app.mount("/api", api_app)
+
+# Frontend: "/" serves static/index.html through the same conditional-GET path
+app.mount("/", CachedStaticFiles(directory="static", html=True), name="frontend")